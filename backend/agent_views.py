@@ -1,7 +1,9 @@
-import lancedb
 import openai
 import os
 import json
+import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 from django.http import JsonResponse
@@ -9,7 +11,11 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.db import connections, transaction, migrations
 
-from .views import KnowledgeObject, ResearchPaper, apply_migrations_to_user_db, user_database_connection
+from .views import KnowledgeObject, ResearchPaper
+from .userdb import apply_migrations_to_user_db, user_database_connection
+from .embeddings import embedding_service
+from .vectordb import lance_cache, user_lancedb_uri, get_user_table
+from .vector_index import apply_search_params, index_manager
 from .models import UserChatLog, AgentPersona, UserActivityList
 
 load_dotenv(dotenv_path='.env.local', override=True)
@@ -18,6 +24,117 @@ os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
 #################RAG AGENT######################
 
+RAG_TABLE_SCHEMAS = {
+    "KnowledgeObject_table": KnowledgeObject,
+    "Research_paper_table": ResearchPaper,
+}
+
+SEARCH_MODES = ('vector', 'hybrid', 'lexical')
+RRF_K = 60  # reciprocal rank fusion constant, from the original RRF paper
+FTS_RETRY_AFTER = '30'  # seconds, sent with the 503 while a full-text index is built
+
+class FullTextIndexPending(Exception):
+    # lexical search on a table whose full-text index isn't built yet
+    pass
+
+def require_fts_index(table, user_id, table_name):
+    uri = user_lancedb_uri(user_id)
+    if not index_manager.has_fts_index(table, uri, table_name):
+        index_manager.schedule(uri, table_name)
+        raise FullTextIndexPending(
+            f"The full-text index of {table_name} is being built, retry shortly or use search_mode 'vector'."
+        )
+
+def rag_where_clause(search_string):
+    return f"({search_string})" if search_string else None
+
+def search_rag_table(table, messages_embedding, search_string, n_results, data):
+    query = table.search(messages_embedding)
+    if search_string:
+        query = query.where(rag_where_clause(search_string), prefilter=True)
+    query = query.metric("cosine").limit(n_results)
+    return apply_search_params(query, 'simple_rag', data).to_df()
+
+def lexical_search_rag_table(table, query_texts, search_string, n_results):
+    # BM25 over the content full-text index, no embedding needed
+    query = table.search(query_texts, query_type='fts')
+    if search_string:
+        query = query.where(rag_where_clause(search_string), prefilter=True)
+    return query.limit(n_results).to_df()
+
+def reciprocal_rank_fusion(result_frames, n_results, k=RRF_K):
+    '''
+    Fuses ranked result frames: every row scores sum(1 / (k + rank)) over the
+    lists it appears in. Rows are matched on (doc_id, content) since a document
+    is stored as several chunks. Keeps _distance / _score where a list had them.
+    '''
+    fused = {}
+    for frame in result_frames:
+        for rank, row in enumerate(frame.to_dict('records'), start=1):
+            key = (row['doc_id'], row['content'])
+            entry = fused.setdefault(key, {'doc_id': row['doc_id'], 'content': row['content'],
+                                           '_distance': None, '_score': None, '_relevance_score': 0.0})
+            entry['_relevance_score'] += 1.0 / (k + rank)
+            for column in ('_distance', '_score'):
+                if row.get(column) is not None:
+                    entry[column] = row[column]
+
+    ranked = sorted(fused.values(), key=lambda entry: entry['_relevance_score'], reverse=True)
+    return pd.DataFrame(ranked[:n_results], columns=['doc_id', 'content', '_distance', '_score', '_relevance_score'])
+
+def fusion_candidates(n_results):
+    # each list is searched deeper than the final cut so the fusion has overlap to work with
+    return max(n_results * 3, 20)
+
+def rag_search(table, user_id, table_name, query_texts, search_string, n_results, data):
+    '''
+    simple_rag retrieval for data['search_mode']:
+      vector  - cosine search on the query embedding (default)
+      lexical - BM25 full-text search only, skips the embedding call
+      hybrid  - both in parallel, fused with reciprocal rank fusion
+    '''
+    search_mode = data.get('search_mode', 'vector')
+    n_results = n_results or 10
+
+    if search_mode == 'lexical':
+        require_fts_index(table, user_id, table_name)
+        return lexical_search_rag_table(table, query_texts, search_string, n_results)
+
+    if search_mode == 'vector':
+        messages_embedding = embedding_service.embed_one(query_texts, model='text-embedding-3-small')
+        return search_rag_table(table, messages_embedding, search_string, n_results, data)
+
+    candidates = fusion_candidates(n_results)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        lexical = executor.submit(lexical_search_rag_table, table, query_texts, search_string, candidates)
+        messages_embedding = embedding_service.embed_one(query_texts, model='text-embedding-3-small')
+        vector_results = search_rag_table(table, messages_embedding, search_string, candidates, data)
+        try:
+            lexical_results = lexical.result()
+        except Exception as e:
+            # e.g. a table written before the full-text index existed
+            logging.warning(f"(simple_rag) full-text search on {table_name} failed, vector results only: {e}")
+            index_manager.schedule(user_lancedb_uri(user_id), table_name)
+            lexical_results = pd.DataFrame(columns=['doc_id', 'content', '_score'])
+
+    return reciprocal_rank_fusion([vector_results, lexical_results], n_results)
+
+def fts_pending_response(e):
+    response = JsonResponse({"status": "error", "message": str(e)}, status=503)
+    response['Retry-After'] = FTS_RETRY_AFTER
+    return response
+
+def format_rag_results(query_results):
+    results = {
+        "doc_id": query_results["doc_id"].tolist(),
+        "documents": query_results["content"].tolist(),
+        "distance": query_results["_distance"].tolist() if "_distance" in query_results else [None] * len(query_results),
+    }
+    for column, key in (("_score", "score"), ("_relevance_score", "relevance_score")):
+        if column in query_results:
+            results[key] = query_results[column].tolist()
+    return results
+
 @csrf_exempt
 def simple_rag(request):
     if request.method == 'POST':
@@ -28,9 +145,15 @@ def simple_rag(request):
         search_string = data.get('search_string')
         n_results = data.get('n_results')
 
+        if data.get('search_mode', 'vector') not in SEARCH_MODES:
+            return JsonResponse({
+                "status": "error",
+                "message": f"search_mode must be one of {', '.join(SEARCH_MODES)}."
+            }, status=400)
+
         try:
             # Connect to the user's database
-            vdb = lancedb.connect(f'userdbs/{user_id}/lancedb')
+            lance_cache.connect(user_lancedb_uri(user_id))
         except Exception as e:
             return JsonResponse({
                 "status": "error",
@@ -38,10 +161,8 @@ def simple_rag(request):
             }, status=500)
 
         try:
-            if table_name == "KnowledgeObject_table":
-                table = vdb.create_table(table_name, schema=KnowledgeObject.to_arrow_schema(), exist_ok=True)
-            elif table_name == "Research_paper_table":
-                table = vdb.create_table(table_name, schema=ResearchPaper.to_arrow_schema(), exist_ok=True)
+            if table_name in RAG_TABLE_SCHEMAS:
+                table = get_user_table(user_id, table_name, RAG_TABLE_SCHEMAS[table_name].to_arrow_schema())
             else:
                 return JsonResponse({
                     "status": "error",
@@ -54,23 +175,10 @@ def simple_rag(request):
             }, status=500)
 
         try:
-            # Get embeddings for the query texts
-            messages_embedding = client.embeddings.create(
-                input=[query_texts], model='text-embedding-3-small'
-            ).data[0].embedding
-            
-            if search_string:
-                where_clause = f"({search_string})"
-                query_results = table.search(messages_embedding)\
-                    .where(where_clause, prefilter=True)\
-                    .metric("cosine")\
-                    .limit(n_results)\
-                    .to_df()
-            else:
-                query_results = table.search(messages_embedding)\
-                    .metric("cosine")\
-                    .limit(n_results)\
-                    .to_df()
+            # Embedding and/or full-text search, depending on data['search_mode']
+            query_results = rag_search(table, user_id, table_name, query_texts, search_string, n_results, data)
+        except FullTextIndexPending as e:
+            return fts_pending_response(e)
         except Exception as e:
             return JsonResponse({
                 "status": "error",
@@ -79,11 +187,7 @@ def simple_rag(request):
 
         try:
             # Format the results
-            results = {
-                "doc_id": query_results["doc_id"].tolist(),
-                "documents": query_results["content"].tolist(),
-                "distance": query_results["_distance"].tolist()
-            }
+            results = format_rag_results(query_results)
         except Exception as e:
             return JsonResponse({
                 "status": "error",
@@ -120,12 +224,9 @@ def save_conversation(request):
             
             db_name = user_database_connection(user_id)
             connection = connections[db_name]
-            with connection.cursor() as cursor:
-                cursor.execute('PRAGMA foreign_keys = OFF;')
+            apply_migrations_to_user_db(connection, db_name)
 
             with transaction.atomic(using=db_name):
-                apply_migrations_to_user_db(connection, db_name)
-
                 # Check if the conversation already exists
                 chat_log, created = UserChatLog.objects.using(db_name).get_or_create(
                     dialog_session_id=dialog_session_id,
@@ -158,12 +259,9 @@ def get_last_conversation(request, user_id):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 chat_log = UserChatLog.objects.using(db_name).order_by('-create_time').first()
 
@@ -191,12 +289,9 @@ def retrieve_conversations(request, user_id, limit=3):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 chat_logs = UserChatLog.objects.using(db_name).order_by('-create_time')[:limit]
                 response_data = [
@@ -228,12 +323,9 @@ def insert_persona(request):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 persona, created = AgentPersona.objects.using(db_name).update_or_create(
                     persona_name=persona_name,
@@ -248,12 +340,9 @@ def delete_persona(request, user_id, persona_name):
     if request.method == 'DELETE':
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 persona = AgentPersona.objects.using(db_name).get(persona_name=persona_name)
                 persona.delete()
@@ -267,12 +356,9 @@ def get_personas(request, user_id):
     if request.method == 'GET':
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 personas = AgentPersona.objects.using(db_name).all()
                 persona_list = {
@@ -287,12 +373,9 @@ def get_persona_by_name(request, user_id, persona_name):
     if request.method == 'GET':
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-        
             try:
                 persona = AgentPersona.objects.using(db_name).get(persona_name=persona_name)
                 persona_data = json.loads(persona.persona_data)
@@ -314,12 +397,9 @@ def insert_activity(request):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 # Use update_or_create to either update an existing record or create a new one
                 activity, created = UserActivityList.objects.using(db_name).update_or_create(
@@ -347,12 +427,9 @@ def update_activity(request):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 activity = UserActivityList.objects.using(db_name).get(activity_id=data['activity_id'])
 
@@ -373,12 +450,9 @@ def delete_activity(request, user_id, activity_id):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 activity = UserActivityList.objects.using(db_name).get(activity_id=activity_id)
                 activity.delete()
@@ -393,12 +467,9 @@ def get_activities(request, user_id):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 since_date = request.GET.get('since', None)
                 if since_date:
@@ -424,12 +495,9 @@ def finish_activity(request, user_id, activity_id):
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
-
             try:
                 activity = UserActivityList.objects.using(db_name).get(activity_id=activity_id)
                 activity.check_flag = 1
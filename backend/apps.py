@@ -0,0 +1,41 @@
+import os
+import sys
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+
+
+class BackendConfig(AppConfig):
+    name = 'backend'
+
+    def ready(self):
+        from .sqlite_pragmas import configure_sqlite_connection
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='backend.configure_sqlite_connection')
+
+        from .models import Document, UserDocument
+        from .document_sampling import invalidate_sample_pool
+        for model in (Document, UserDocument):
+            post_save.connect(invalidate_sample_pool, sender=model, dispatch_uid=f'backend.sample_pool.save.{model.__name__}')
+            post_delete.connect(invalidate_sample_pool, sender=model, dispatch_uid=f'backend.sample_pool.delete.{model.__name__}')
+
+        from .feed_cache import invalidate_display_feed
+        post_save.connect(invalidate_display_feed, sender=Document, dispatch_uid='backend.display_feed.save')
+        post_delete.connect(invalidate_display_feed, sender=Document, dispatch_uid='backend.display_feed.delete')
+
+        self.start_job_workers()
+
+    def start_job_workers(self):
+        # Web processes run JOB_WORKERS worker threads; other management commands don't,
+        # and run_job_workers starts its own. The runserver autoreloader parent is skipped too.
+        if getattr(settings, 'JOB_WORKERS', 0) <= 0:
+            return
+        command = sys.argv[1] if len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py' else None
+        if command not in (None, 'runserver'):
+            return
+        if command == 'runserver' and '--noreload' not in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            return
+
+        from . import job_handlers  # registers the job handlers
+        from .jobs import job_queue
+        job_queue.start()
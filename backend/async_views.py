@@ -0,0 +1,317 @@
+# async_views.py
+# Async variants of the OpenAI-bound views. They run on the ASGI event loop
+# (backend/asgi.py) and share one AsyncOpenAI client, so a waiting LLM call
+# doesn't hold a worker thread. Blocking work (LanceDB, tokenizers) is
+# pushed to threads with sync_to_async.
+import json
+import time
+import asyncio
+import logging
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from .llm_clients import async_client
+from .completion_cache import completion_cache, CACHE_MODES
+from .embeddings import embedding_service
+from .vectordb import get_user_table, user_lancedb_uri
+from .vector_index import index_manager
+from .streaming import stream_chat_completion
+from .openai_views import (
+    image_question_messages, description_payload, continue_description, rag_messages_payload,
+    DESCRIPTION_MODES, DescriptionBudgetError, MAP_REDUCE_MAX_ROUNDS, description_language, use_map_reduce, map_section_budget,
+    split_sections, map_section_messages, join_partial_summaries, reduce_messages, new_stage, record_call,
+)
+from .agent_views import (
+    RAG_TABLE_SCHEMAS, SEARCH_MODES, search_rag_table, lexical_search_rag_table, reciprocal_rank_fusion,
+    fusion_candidates, format_rag_results, FullTextIndexPending, require_fts_index, fts_pending_response,
+)
+
+def async_csrf_exempt(view_func):
+    # django.views.decorators.csrf.csrf_exempt wraps async views in a sync function on Django 4.2
+    view_func.csrf_exempt = True
+    return view_func
+
+def in_thread(func):
+    return sync_to_async(func, thread_sensitive=False)
+
+@async_csrf_exempt
+async def ask_question_about_image(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+        image_path = data.get("image_path")
+        question = data.get("question")
+
+        if not image_path or not question:
+            return JsonResponse({"error": "image_path and question are required"}, status=400)
+
+        completions = await async_client.chat.completions.create(
+            model="gpt-4o",
+            messages=image_question_messages(image_path, question),
+            max_tokens=300,
+        )
+        response = completions.choices[0].message.content
+
+        return JsonResponse({"response": response}, status=200)
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        return JsonResponse({"error": "An error occurred while processing the request"}, status=500)
+
+@async_csrf_exempt
+async def generate_description(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=400)
+
+    data = json.loads(request.body)
+    text = data.get('text')
+    AI_rules = data.get('AI_rules')
+    model_name = data.get('model_name', 'gpt-3.5-turbo')
+    max_tokens = data.get('max_tokens', 0)
+    max_output_tokens = data.get('max_output_tokens', 500)
+    lang_mode = data.get('lang_mode', 1)
+    mode = data.get('mode', 'truncate')
+    cache_mode = data.get('cache', 'use')
+    if mode not in DESCRIPTION_MODES:
+        return JsonResponse({'error': f"mode must be one of {', '.join(DESCRIPTION_MODES)}"}, status=400)
+    if cache_mode not in CACHE_MODES:
+        return JsonResponse({'error': f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
+
+    try:
+        if await in_thread(use_map_reduce)(mode, text, model_name, max_tokens, max_output_tokens):
+            description, stages = await map_reduce_description(text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, cache_mode)
+            return JsonResponse({
+                'description': description,
+                'mode': 'map_reduce',
+                'stages': stages,
+                'total_tokens': sum(stage['total_tokens'] for stage in stages),
+            }, status=200)
+
+        messages_payload, max_total_tokens = await in_thread(description_payload)(
+            text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode
+        )
+
+        complete_response = ""
+        total_tokens_used = 0
+        while True:
+            completions = await completion_cache.acreate(
+                async_client, cache_mode,
+                model=model_name,
+                messages=messages_payload,
+                max_tokens=max_output_tokens,
+                temperature=0.0
+            )
+
+            complete_response += completions.choices[0].message.content
+            total_tokens_used += completions.usage.total_tokens
+
+            if not continue_description(completions, messages_payload):
+                break
+
+            if total_tokens_used >= max_total_tokens:
+                print(f"total_tokens_used {total_tokens_used} >= max_model_tokens")
+                break
+
+        return JsonResponse({'description': complete_response}, status=200)
+    except DescriptionBudgetError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f"An error occurred while generating the description: {e}"}, status=500)
+
+async def map_reduce_description(text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, cache_mode='use'):
+    # async twin of openai_views.map_reduce_description, the map calls run concurrently on the loop
+    languagestr = await in_thread(description_language)(text, lang_mode)
+    section_tokens = await in_thread(map_section_budget)(model_name, max_tokens, max_output_tokens)
+    semaphore = asyncio.Semaphore(getattr(settings, 'DESCRIPTION_MAP_WORKERS', 8))
+
+    async def timed_completion(messages):
+        async with semaphore:
+            start = time.perf_counter()
+            completions = await completion_cache.acreate(
+                async_client, cache_mode,
+                model=model_name,
+                messages=messages,
+                max_tokens=max_output_tokens,
+                temperature=0.0
+            )
+            return completions, time.perf_counter() - start
+
+    stages = []
+    content = text
+    for round_index in range(MAP_REDUCE_MAX_ROUNDS):
+        sections = await in_thread(split_sections)(content, section_tokens, model_name)
+        if len(sections) <= 1:
+            break
+
+        stage = new_stage(f"map_{round_index + 1}")
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            timed_completion(map_section_messages(section, i, len(sections))) for i, section in enumerate(sections)
+        ])
+        for completions, elapsed in results:
+            record_call(stage, completions, elapsed)
+        stage['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        stages.append(stage)
+
+        content = join_partial_summaries([completions.choices[0].message.content for completions, _ in results])
+
+    if stages:
+        messages_payload = reduce_messages(content, AI_rules, languagestr)
+    else:
+        messages_payload, _ = await in_thread(description_payload)(
+            content, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, languagestr
+        )
+
+    stage = new_stage("reduce")
+    start = time.perf_counter()
+    complete_response = ""
+    while True:
+        completions, elapsed = await timed_completion(messages_payload)
+        record_call(stage, completions, elapsed)
+        complete_response += completions.choices[0].message.content
+        if not continue_description(completions, messages_payload) or stage['calls'] >= MAP_REDUCE_MAX_ROUNDS:
+            break
+    stage['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    stages.append(stage)
+
+    return complete_response, stages
+
+async def chat_response(data, messages_payload, model):
+    if data.get('stream', False):
+        return stream_chat_completion(async_client, data.get('stream_format', 'sse'), model=model, messages=messages_payload, temperature=0.0)
+
+    try:
+        completions = await completion_cache.acreate(
+            async_client, data.get('cache', 'use'),
+            model=model,
+            messages=messages_payload,
+            temperature=0.0
+        )
+        return JsonResponse({'response_content': completions.choices[0].message.content})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@async_csrf_exempt
+async def generate_response(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    data = json.loads(request.body)
+    context = data.get('context', '')
+    messages = data.get('messages', '')
+    model = data.get('model', 'gpt-4o-2024-05-13')
+    if data.get('cache', 'use') not in CACHE_MODES:
+        return JsonResponse({'error': f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
+
+    messages_payload = [
+        {"role": "system", "content": f"{context}"},
+        {"role": "user", "content": f"{messages}"},
+    ]
+    return await chat_response(data, messages_payload, model)
+
+@async_csrf_exempt
+async def generate_response_rag(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    data = json.loads(request.body)
+    context = data.get('context', '')
+    messages = data.get('messages', '')
+    model = data.get('model', 'gpt-4o-2024-05-13')
+    if data.get('cache', 'use') not in CACHE_MODES:
+        return JsonResponse({'error': f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
+
+    try:
+        last_input = messages[-1]['content']
+        messages_embedding = await embedding_service.aembed_one(last_input, model='text-embedding-3-small')
+        messages_payload = await in_thread(rag_messages_payload)(context, messages, messages_embedding, data)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+    return await chat_response(data, messages_payload, model)
+
+async def rag_search(table, user_id, table_name, query_texts, search_string, n_results, data, search_mode):
+    # async twin of agent_views.rag_search: the BM25 search runs while the embedding call is in flight
+    n_results = n_results or 10
+    if search_mode == 'lexical':
+        await in_thread(require_fts_index)(table, user_id, table_name)
+        return await in_thread(lexical_search_rag_table)(table, query_texts, search_string, n_results)
+
+    if search_mode == 'vector':
+        messages_embedding = await embedding_service.aembed_one(query_texts, model='text-embedding-3-small')
+        return await in_thread(search_rag_table)(table, messages_embedding, search_string, n_results, data)
+
+    candidates = fusion_candidates(n_results)
+
+    async def vector_search():
+        messages_embedding = await embedding_service.aembed_one(query_texts, model='text-embedding-3-small')
+        return await in_thread(search_rag_table)(table, messages_embedding, search_string, candidates, data)
+
+    vector_results, lexical_results = await asyncio.gather(
+        vector_search(),
+        in_thread(lexical_search_rag_table)(table, query_texts, search_string, candidates),
+        return_exceptions=True,
+    )
+    if isinstance(vector_results, BaseException):
+        raise vector_results
+    if isinstance(lexical_results, BaseException):
+        logging.warning(f"(simple_rag) full-text search on {table_name} failed, vector results only: {lexical_results}")
+        index_manager.schedule(user_lancedb_uri(user_id), table_name)
+        lexical_results = pd.DataFrame(columns=['doc_id', 'content', '_score'])
+
+    return await in_thread(reciprocal_rank_fusion)([vector_results, lexical_results], n_results)
+
+@async_csrf_exempt
+async def simple_rag(request):
+    if request.method != 'POST':
+        return JsonResponse({
+            "status": "error",
+            "message": "Invalid request method. Only POST is allowed."
+        }, status=405)
+
+    data = json.loads(request.body)
+    user_id = data.get('user_id')
+    table_name = data.get('table_name')
+    query_texts = data.get('query_texts')
+    search_string = data.get('search_string')
+    n_results = data.get('n_results')
+
+    search_mode = data.get('search_mode', 'vector')
+
+    if table_name not in RAG_TABLE_SCHEMAS:
+        return JsonResponse({
+            "status": "error",
+            "message": f"Table name {table_name} is not recognized."
+        }, status=400)
+    if search_mode not in SEARCH_MODES:
+        return JsonResponse({
+            "status": "error",
+            "message": f"search_mode must be one of {', '.join(SEARCH_MODES)}."
+        }, status=400)
+
+    try:
+        table = await in_thread(get_user_table)(user_id, table_name, RAG_TABLE_SCHEMAS[table_name].to_arrow_schema())
+    except Exception as e:
+        return JsonResponse({
+            "status": "error",
+            "message": f"Failed to create or access table. Reason: {str(e)}"
+        }, status=500)
+
+    try:
+        query_results = await rag_search(table, user_id, table_name, query_texts, search_string, n_results, data, search_mode)
+        results = format_rag_results(query_results)
+    except FullTextIndexPending as e:
+        return fts_pending_response(e)
+    except Exception as e:
+        return JsonResponse({
+            "status": "error",
+            "message": f"Failed to query table. Reason: {str(e)}"
+        }, status=500)
+
+    return JsonResponse({
+        "status": "success",
+        "message": "Query executed successfully.",
+        "data": results
+    }, status=200)
@@ -0,0 +1,104 @@
+# audio_cache.py
+import os
+import json
+import uuid
+import subprocess
+import threading
+from concurrent.futures import Future
+from moviepy.config import get_setting
+from django.conf import settings
+
+def extract_audio_track(video_path, output_path, codec_args=()):
+    # ffmpeg picks the encoder from the output extension unless codec_args say otherwise
+    cmd = [get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error', '-i', video_path, '-vn', *codec_args, output_path]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg failed for {video_path}: {e.stderr.decode(errors='ignore')}")
+
+class AudioArtifactCache:
+    '''
+    Extracts the audio track of a video once and serves it from disk afterwards.
+    The output path is <video dir>/audios/<video name>, as process_meta_item
+    always returned. A sidecar <audio>.src records the source mtime and size;
+    a changed video is extracted again. Concurrent requests for the same video
+    wait on the single in-flight extraction.
+    '''
+
+    def __init__(self, mode='transcode', bitrate='32k'):
+        self.mode = mode  # 'transcode' (small file) or 'copy' (no re-encode)
+        self.bitrate = bitrate
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def audio_path_for(video_path):
+        return f"{os.path.dirname(video_path)}/audios/{os.path.basename(video_path)}"
+
+    @staticmethod
+    def _source_stamp(video_path):
+        stat = os.stat(video_path)
+        return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+    def _is_fresh(self, audio_path, stamp):
+        try:
+            with open(f"{audio_path}.src") as f:
+                return os.path.exists(audio_path) and json.load(f) == stamp
+        except (OSError, ValueError):
+            return False
+
+    def _extract(self, video_path, audio_path, stamp):
+        audio_dir = os.path.dirname(audio_path)
+        os.makedirs(audio_dir, exist_ok=True)
+        # written next to the target and renamed, so readers never see a partial file
+        _, ext = os.path.splitext(audio_path)
+        temp_path = os.path.join(audio_dir, f".{uuid.uuid4().hex}{ext}")
+
+        if self.mode == 'copy':
+            codec_args = ['-c:a', 'copy']
+        else:
+            codec_args = ['-b:a', self.bitrate]
+
+        try:
+            extract_audio_track(video_path, temp_path, codec_args)
+            os.replace(temp_path, audio_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with open(f"{audio_path}.src", 'w') as f:
+            json.dump(stamp, f)
+
+    def extract(self, video_path):
+        audio_path = self.audio_path_for(video_path)
+        stamp = self._source_stamp(video_path)
+        if self._is_fresh(audio_path, stamp):
+            return audio_path
+
+        key = (os.path.abspath(video_path), stamp['mtime_ns'], stamp['size'])
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            if not self._is_fresh(audio_path, stamp):
+                self._extract(video_path, audio_path, stamp)
+            future.set_result(audio_path)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return audio_path
+
+audio_cache = AudioArtifactCache(
+    mode=getattr(settings, 'AUDIO_EXTRACT_MODE', 'transcode'),
+    bitrate=getattr(settings, 'AUDIO_EXTRACT_BITRATE', '32k'),
+)
@@ -0,0 +1,224 @@
+# completion_cache.py
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai.types.chat import ChatCompletion
+
+# per-request cache control, e.g. data.get('cache', 'use')
+CACHE_MODES = ('use', 'bypass', 'refresh')
+
+def completion_key(kwargs):
+    # sha256 over the model, messages and every other request parameter
+    payload = json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def is_cacheable(kwargs):
+    # only deterministic, single-choice, non-streamed requests
+    return (
+        kwargs.get('temperature', 1) == 0
+        and not kwargs.get('stream', False)
+        and kwargs.get('n', 1) == 1
+    )
+
+class _OwnerCancelled(Exception):
+    # set on a shared call when the request that made it is cancelled, a waiter retries it
+    pass
+
+class CompletionCache:
+    '''
+    Disk-backed cache of temperature-0 chat completions keyed by a hash of the
+    request. Entries live for ttl seconds; past max_bytes the least recently
+    used ones are evicted. Concurrent identical requests share one API call.
+    cache_mode 'bypass' neither reads nor writes the cache, 'refresh' skips
+    the read but stores the new response.
+    '''
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._ainflight = {}
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS completion_cache ('
+                'key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS completion_cache_last_used ON completion_cache (last_used)')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode = WAL;')
+            conn.execute('PRAGMA synchronous = NORMAL;')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT response, created FROM completion_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        response, created = row
+        now = time.time()
+        with conn:
+            if now - created > self.ttl:
+                conn.execute('DELETE FROM completion_cache WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE completion_cache SET last_used = ? WHERE key = ?', (now, key))
+        return ChatCompletion.construct(**json.loads(response))
+
+    def set(self, key, completion):
+        response = completion.model_dump_json()
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO completion_cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, completion.model, response, len(response), now, now),
+            )
+
+        with self._lock:
+            self._writes += 1
+            due = self._writes >= 100
+            if due:
+                self._writes = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM completion_cache WHERE created < ?', (time.time() - self.ttl,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM completion_cache').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            stale = []
+            for key, size in conn.execute('SELECT key, size FROM completion_cache ORDER BY last_used'):
+                stale.append((key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            conn.executemany('DELETE FROM completion_cache WHERE key = ?', stale)
+
+    def _lookup(self, key, cache_mode):
+        if cache_mode == 'use':
+            completion = self.get(key)
+            if completion is not None:
+                with self._lock:
+                    self.hits += 1
+                return completion
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def create(self, client, cache_mode='use', **kwargs):
+        # drop-in for client.chat.completions.create
+        if cache_mode not in CACHE_MODES:
+            raise ValueError(f"cache must be one of {', '.join(CACHE_MODES)}")
+        if cache_mode == 'bypass' or not is_cacheable(kwargs):
+            return client.chat.completions.create(**kwargs)
+
+        key = completion_key(kwargs)
+        completion = self._lookup(key, cache_mode)
+        if completion is not None:
+            return completion
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            with self._lock:
+                self.shared += 1
+            return future.result()
+
+        try:
+            completion = client.chat.completions.create(**kwargs)
+            self.set(key, completion)
+            future.set_result(completion)
+            return completion
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def acreate(self, async_client, cache_mode='use', **kwargs):
+        # async twin of create(); the SQLite reads and writes run in a thread, the API call on the loop
+        if cache_mode not in CACHE_MODES:
+            raise ValueError(f"cache must be one of {', '.join(CACHE_MODES)}")
+        if cache_mode == 'bypass' or not is_cacheable(kwargs):
+            return await async_client.chat.completions.create(**kwargs)
+
+        key = completion_key(kwargs)
+        completion = await sync_to_async(self._lookup, thread_sensitive=False)(key, cache_mode)
+        if completion is not None:
+            return completion
+
+        while True:
+            future = self._ainflight.get(key)
+            if future is None:
+                break
+            try:
+                completion = await asyncio.shield(future)
+            except _OwnerCancelled:
+                continue  # take the call over, or wait for whichever waiter did
+            with self._lock:
+                self.shared += 1
+            return completion
+
+        future = asyncio.get_running_loop().create_future()
+        self._ainflight[key] = future
+        try:
+            completion = await async_client.chat.completions.create(**kwargs)
+            future.set_result(completion)
+            await sync_to_async(self.set, thread_sensitive=False)(key, completion)
+            return completion
+        except BaseException as e:
+            if not future.done():
+                # a cancelled owner must not cancel the requests waiting on its call
+                future.set_exception(_OwnerCancelled() if isinstance(e, asyncio.CancelledError) else e)
+                # nobody may be waiting, don't log "exception was never retrieved"
+                future.exception()
+            raise
+        finally:
+            self._ainflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            hits, misses, shared = self.hits, self.misses, self.shared
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'shared': shared,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+
+completion_cache = CompletionCache(
+    getattr(settings, 'COMPLETION_CACHE_PATH', os.path.join(settings.BASE_DIR, 'master', 'completion_cache.sqlite3')),
+    ttl=getattr(settings, 'COMPLETION_CACHE_TTL', 7 * 24 * 3600),
+    max_bytes=getattr(settings, 'COMPLETION_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+)
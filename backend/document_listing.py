@@ -0,0 +1,110 @@
+# document_listing.py
+import json
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+
+# model field -> response key, "{}" is replaced with Document / Video / Instance
+DOCUMENT_FIELDS = {
+    'doc_id': "{} ID",
+    'doc_title': "{} Title",
+    'doc_uri': "{} URI",
+    'doc_type': "{} Type",
+    'doc_desc': "{} Description",
+    'doc_text': "{} Text",
+    'file_type': "File Type",
+    'doc_createdate': "Create Date",
+    'doc_revisedate': "Revise Date",
+    'display_date': "Display Date",
+    'expire_date': "Expire Date",
+    'share_flag': "Share Flag",
+    'audit_flag': "Audit Flag",
+    'doc_meta': "{} Meta",
+    'doc_loc': "{} Location",
+    'doc_md5': "{} MD5",
+}
+
+# can be megabytes per row, only listed when asked for
+HEAVY_FIELDS = {'doc_text', 'doc_meta'}
+
+# columns the keyset cursor is built from
+CURSOR_FIELDS = ('doc_createdate', 'doc_id')
+
+class InvalidListingParams(ValueError):
+    pass
+
+def file_type_label(file_type):
+    if file_type == 'documents': return 'Document'
+    elif file_type == 'videos': return 'Video'
+    return 'Instance'
+
+def resolve_fields(fields=None, include_text=False):
+    '''
+    Returns the model fields to select. Without `fields` every column is listed
+    except the heavy ones, which need include_text=True or an explicit mention.
+    '''
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    if fields:
+        unknown = [f for f in fields if f not in DOCUMENT_FIELDS]
+        if unknown:
+            raise InvalidListingParams(f"Unknown fields: {', '.join(unknown)}")
+        return [f for f in DOCUMENT_FIELDS if f in fields]
+
+    return [f for f in DOCUMENT_FIELDS if include_text or f not in HEAVY_FIELDS]
+
+def encode_cursor(row):
+    createdate = row['doc_createdate']
+    payload = [createdate.isoformat() if createdate else None, row['doc_id']]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor):
+    if not isinstance(cursor, str):
+        raise InvalidListingParams("Invalid cursor: expected the next_cursor string of the previous page")
+    try:
+        createdate, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(doc_id, str):
+            raise TypeError(f"bad doc_id {doc_id!r}")
+        return (datetime.fromisoformat(createdate) if createdate else None), doc_id
+    except (ValueError, TypeError) as e:
+        raise InvalidListingParams(f"Invalid cursor: {e}")
+
+def page_size(limit=None):
+    default = getattr(settings, 'DOCUMENT_LIST_PAGE_SIZE', 100)
+    maximum = getattr(settings, 'DOCUMENT_LIST_MAX_PAGE_SIZE', 1000)
+    if limit is None:
+        return default
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise InvalidListingParams(f"Invalid limit: {limit}")
+    return max(1, min(limit, maximum))
+
+def to_response_row(row, fields, fileType):
+    return {DOCUMENT_FIELDS[f].format(fileType): row[f] for f in fields}
+
+def list_page(queryset, fileType, fields, limit=None, cursor=None):
+    '''
+    One page of documents ordered by (doc_createdate, doc_id), selecting only
+    `fields`. Returns (rows, next_cursor); next_cursor is None on the last page.
+    Without a limit or cursor every row is returned, as before pagination.
+    '''
+    queryset = queryset.order_by(*CURSOR_FIELDS)
+    if limit is None and not cursor:
+        return [to_response_row(row, fields, fileType) for row in queryset.values(*fields).iterator()], None
+
+    limit = page_size(limit)
+
+    if cursor:
+        createdate, doc_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(doc_createdate__gt=createdate) | Q(doc_createdate=createdate, doc_id__gt=doc_id)
+        )
+
+    # one extra row tells whether there is a next page
+    selected = list(dict.fromkeys([*fields, *CURSOR_FIELDS]))
+    rows = list(queryset.values(*selected)[:limit + 1])
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [to_response_row(row, fields, fileType) for row in rows[:limit]], next_cursor
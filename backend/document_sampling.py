@@ -0,0 +1,60 @@
+# document_sampling.py
+import time
+import random
+import threading
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .userdb import user_db_pool
+
+class DocumentSamplePool:
+    '''
+    Keeps, per database alias, the ids and display/expire dates of the documents
+    that are not expired yet, so display_documents can pick random documents
+    without making SQLite sort the whole table by RANDOM().
+    A pool is reloaded after refresh_interval seconds or when a document of
+    that database is saved or deleted.
+    '''
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self._pools = {}  # alias -> (loaded at (monotonic), [(doc_id, display_date, expire_date)])
+        self._lock = threading.Lock()
+
+    def invalidate(self, using):
+        with self._lock:
+            self._pools.pop(using, None)
+
+    def _entries(self, model, using, now):
+        with self._lock:
+            pool = self._pools.get(using)
+        if pool is not None and time.monotonic() - pool[0] < self.refresh_interval:
+            return pool[1]
+
+        entries = list(
+            model.objects.using(using)
+            .filter(Q(expire_date__isnull=True) | Q(expire_date__gte=now))
+            .values_list('doc_id', 'display_date', 'expire_date')
+        )
+        with self._lock:
+            self._pools[using] = (time.monotonic(), entries)
+        return entries
+
+    def sample_ids(self, model, using, amount, now=None):
+        # Visibility is re-checked here, documents whose display_date passed
+        # since the pool was loaded show up without a reload.
+        now = now or timezone.now()
+        visible = [
+            doc_id for doc_id, display_date, expire_date in self._entries(model, using, now)
+            if (display_date is None or display_date <= now) and (expire_date is None or expire_date >= now)
+        ]
+        return random.sample(visible, min(amount, len(visible)))
+
+def invalidate_sample_pool(sender, instance, using, **kwargs):
+    document_sample_pool.invalidate(using)
+
+document_sample_pool = DocumentSamplePool(
+    refresh_interval=getattr(settings, 'DOCUMENT_SAMPLE_POOL_REFRESH', 300),
+)
+user_db_pool.add_eviction_hook(document_sample_pool.invalidate)
@@ -0,0 +1,152 @@
+# embedding_cache.py
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    '''
+    Content-addressed embedding cache keyed by (model, sha256(text)).
+    An in-memory LRU of memory_size float32 arrays sits in front of a SQLite file
+    holding at most max_rows vectors; the least recently used rows are
+    evicted once the file grows past that size.
+    '''
+
+    def __init__(self, path, memory_size=4096, max_rows=500000):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS embedding_cache ('
+                'model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, '
+                'last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS embedding_cache_last_used ON embedding_cache (last_used)')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode = WAL;')
+            conn.execute('PRAGMA synchronous = NORMAL;')
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get_many(self, model, texts):
+        # returns a list aligned with texts, None for misses
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = (model, text_hash(text))
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector.tolist()
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key[1], []).append(i)
+
+        if missing:
+            conn = self._connection()
+            hashes = list(missing)
+            found = {}
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = conn.execute(
+                    f'SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({",".join("?" * len(chunk))})',
+                    [model, *chunk],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                with conn:
+                    conn.executemany(
+                        'UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?',
+                        [(time.time(), model, h) for h in found],
+                    )
+
+            misses = disk_hits = 0
+            for h, positions in missing.items():
+                blob = found.get(h)
+                if blob is None:
+                    misses += len(positions)
+                    continue
+                vector = array('f', blob)
+                self._remember((model, h), vector)
+                disk_hits += len(positions)
+                for i in positions:
+                    results[i] = vector.tolist()
+            with self._lock:
+                self.misses += misses
+                self.disk_hits += disk_hits
+        return results
+
+    def set_many(self, model, texts, vectors):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            h = text_hash(text)
+            vector = array('f', vector)
+            self._remember((model, h), vector)
+            rows.append((model, h, vector.tobytes(), now))
+
+        conn = self._connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?)', rows)
+
+        with self._lock:
+            self._writes += len(rows)
+            due = self._writes >= 1000
+            if due:
+                self._writes = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        conn = self._connection()
+        with conn:
+            count = conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+            if count > self.max_rows:
+                conn.execute(
+                    'DELETE FROM embedding_cache WHERE rowid IN '
+                    '(SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?)',
+                    (count - self.max_rows,),
+                )
+
+    def stats(self):
+        with self._lock:
+            memory_hits, disk_hits, misses = self.memory_hits, self.disk_hits, self.misses
+            memory_entries = len(self._memory)
+        lookups = memory_hits + disk_hits + misses
+        return {
+            'memory_hits': memory_hits,
+            'disk_hits': disk_hits,
+            'misses': misses,
+            'hit_rate': (memory_hits + disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': memory_entries,
+        }
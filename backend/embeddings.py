@@ -0,0 +1,197 @@
+# embeddings.py
+import os
+import time
+import asyncio
+import random
+import logging
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from dotenv import load_dotenv
+from django.conf import settings
+
+from .embedding_cache import EmbeddingCache
+from .utils import get_encoding
+from .llm_clients import async_client
+
+load_dotenv(dotenv_path='.env.local', override=True)
+
+DEFAULT_EMBEDDING_MODEL = 'text-embedding-3-small'
+MAX_INPUT_TOKENS = 8191  # per input limit of the embeddings endpoint
+MAX_BATCH_INPUTS = 2048  # per request limit of the embeddings endpoint
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+class EmbeddingService:
+    '''
+    Embeds many texts with as few API calls as possible.
+    Texts are grouped into batches bounded by max_batch_tokens and
+    max_batch_size, batches run concurrently on max_workers threads and
+    are retried with exponential backoff. Results keep the input order.
+    With a cache, only texts missing from it are sent to the API.
+    '''
+
+    def __init__(self, client, model=DEFAULT_EMBEDDING_MODEL, max_batch_tokens=100000,
+                 max_batch_size=512, max_workers=4, max_retries=5, backoff=1.0, cache=None, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.cache = cache
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_INPUTS)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _get_encoding(self):
+        # all text-embedding-3 / ada-002 models share cl100k_base
+        return get_encoding(self.model)
+
+    def _prepare(self, text):
+        # returns (text, token count), truncating inputs the endpoint would reject
+        enc = self._get_encoding()
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) > MAX_INPUT_TOKENS:
+            tokens = tokens[:MAX_INPUT_TOKENS]
+            return enc.decode(tokens), MAX_INPUT_TOKENS
+        return text, len(tokens)
+
+    def make_batches(self, texts):
+        # returns a list of batches, each a list of (position, text)
+        batches = []
+        batch, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            text, n_tokens = self._prepare(text)
+            if batch and (batch_tokens + n_tokens > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append((i, text))
+            batch_tokens += n_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, batch, model):
+        inputs = [text for _, text in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.client.embeddings.create(input=inputs, model=model)
+                data = sorted(response.data, key=lambda item: item.index)
+                return [item.embedding for item in data]
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+                logging.warning(f"(EmbeddingService) {type(e).__name__}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _embed_uncached(self, texts, model):
+        batches = self.make_batches(texts)
+        embeddings = [None] * len(texts)
+
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0], model)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                results = list(executor.map(lambda batch: self._embed_batch(batch, model), batches))
+
+        for batch, vectors in zip(batches, results):
+            for (i, _), vector in zip(batch, vectors):
+                embeddings[i] = vector
+        return embeddings
+
+    def embed(self, texts, model=None):
+        model = model or self.model
+        texts = [text or ' ' for text in texts]
+        if not texts:
+            return []
+
+        if self.cache is not None:
+            embeddings = self.cache.get_many(model, texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        if missing:
+            # identical chunks inside one document are embedded once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            vectors = self._embed_uncached(unique_texts, model)
+            by_text = dict(zip(unique_texts, vectors))
+            for i in missing:
+                embeddings[i] = by_text[texts[i]]
+            if self.cache is not None:
+                self.cache.set_many(model, unique_texts, vectors)
+        return embeddings
+
+    def embed_one(self, text, model=None):
+        return self.embed([text], model=model)[0]
+
+    async def _aembed_batch(self, batch, model, semaphore):
+        inputs = [text for _, text in batch]
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self.async_client.embeddings.create(input=inputs, model=model)
+                    data = sorted(response.data, key=lambda item: item.index)
+                    return [item.embedding for item in data]
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+                    logging.warning(f"(EmbeddingService) {type(e).__name__}, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def aembed(self, texts, model=None):
+        # same as embed() for async views: cache I/O runs in a thread, API calls on the event loop
+        model = model or self.model
+        texts = [text or ' ' for text in texts]
+        if not texts:
+            return []
+
+        if self.cache is not None:
+            embeddings = await sync_to_async(self.cache.get_many, thread_sensitive=False)(model, texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        if missing:
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            batches = self.make_batches(unique_texts)
+            semaphore = asyncio.Semaphore(self.max_workers)
+            results = await asyncio.gather(*(self._aembed_batch(batch, model, semaphore) for batch in batches))
+
+            by_text = {}
+            for batch, vectors in zip(batches, results):
+                for (i, _), vector in zip(batch, vectors):
+                    by_text[unique_texts[i]] = vector
+            for i in missing:
+                embeddings[i] = by_text[texts[i]]
+            if self.cache is not None:
+                await sync_to_async(self.cache.set_many, thread_sensitive=False)(model, unique_texts, [by_text[t] for t in unique_texts])
+        return embeddings
+
+    async def aembed_one(self, text, model=None):
+        return (await self.aembed([text], model=model))[0]
+
+# retries are handled by EmbeddingService, so the SDK's own retries are disabled
+client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+embedding_service = EmbeddingService(
+    client,
+    model=getattr(settings, 'EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL),
+    max_batch_tokens=getattr(settings, 'EMBEDDING_BATCH_MAX_TOKENS', 100000),
+    max_batch_size=getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 512),
+    max_workers=getattr(settings, 'EMBEDDING_MAX_WORKERS', 4),
+    max_retries=getattr(settings, 'EMBEDDING_MAX_RETRIES', 5),
+    cache=EmbeddingCache(
+        getattr(settings, 'EMBEDDING_CACHE_PATH', os.path.join(settings.BASE_DIR, 'master', 'embedding_cache.sqlite3')),
+        memory_size=getattr(settings, 'EMBEDDING_CACHE_MEMORY_SIZE', 4096),
+        max_rows=getattr(settings, 'EMBEDDING_CACHE_MAX_ROWS', 500000),
+    ),
+    async_client=async_client.with_options(max_retries=0),
+)
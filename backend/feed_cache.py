@@ -0,0 +1,67 @@
+# feed_cache.py
+import math
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Document
+
+FEED_KEY_PREFIX = 'display_documents:master'
+GENERATION_KEY = f'{FEED_KEY_PREFIX}:generation'
+
+def feed_cache():
+    return caches[getattr(settings, 'DISPLAY_FEED_CACHE', 'default')]
+
+def _generation(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 0, timeout=None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+def seconds_until_visibility_change(now):
+    '''
+    Seconds until the next Document enters its display window or expires, or
+    None when no such boundary is ahead. A cached feed must not outlive it.
+    '''
+    boundaries = Document.objects.aggregate(
+        next_display=Min('display_date', filter=Q(display_date__gt=now)),
+        next_expire=Min('expire_date', filter=Q(expire_date__gte=now)),
+    )
+    upcoming = [b for b in boundaries.values() if b is not None]
+    if not upcoming:
+        return None
+    # expire_date is inclusive, so the document disappears just after it
+    return max(1, math.ceil((min(upcoming) - now).total_seconds()) + 1)
+
+def get_display_feed(amount, build):
+    '''
+    Returns the cached master display_documents feed for `amount`, calling
+    build() on a miss. Entries are keyed on a generation number that document
+    writes bump, and expire at the next display/expire boundary at the latest.
+    '''
+    cache = feed_cache()
+    key = f'{FEED_KEY_PREFIX}:{_generation(cache)}:{amount if amount is not None else "all"}'
+
+    news_items = cache.get(key)
+    if news_items is not None:
+        return news_items
+
+    now = timezone.now()
+    news_items = build(now)
+
+    timeout = getattr(settings, 'DISPLAY_FEED_CACHE_TIMEOUT', 60)
+    boundary = seconds_until_visibility_change(now)
+    if boundary is not None:
+        timeout = min(timeout, boundary)
+    cache.set(key, news_items, timeout=timeout)
+    return news_items
+
+def invalidate_display_feed(**kwargs):
+    # signal receiver for Document writes; old generations age out on their own
+    cache = feed_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
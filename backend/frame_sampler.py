@@ -0,0 +1,123 @@
+# frame_sampler.py
+import os
+import base64
+import threading
+from collections import OrderedDict
+import cv2
+from django.conf import settings
+
+# "detail": "low" vision inputs are a single 512x512 tile
+LOW_DETAIL_SIDE = 512
+
+def video_key(video_path):
+    stat = os.stat(video_path)
+    return (os.path.abspath(video_path), stat.st_mtime_ns, stat.st_size)
+
+def resize_for_vision(frame, max_side=LOW_DETAIL_SIDE):
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+def dhash(frame):
+    # 64-bit difference hash of the frame
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+class FrameSampler:
+    '''
+    Samples one frame every interval seconds from a video for generate_summary.
+    Frames are decoded sequentially with grab()/retrieve() (one seek per gap
+    instead of one per sample), shrunk to the low-detail vision size and
+    JPEG-encoded. Samples are cached per video (path, mtime, size) and time
+    point, so overlapping meta items of the same video don't decode again.
+    Near-duplicate consecutive frames are dropped by perceptual hash.
+    '''
+
+    def __init__(self, max_cache_bytes=256 * 1024 * 1024, max_grab_gap=10, dedupe_distance=4):
+        self.max_cache_bytes = max_cache_bytes
+        self.max_grab_gap = max_grab_gap  # seconds worth of frames to grab through instead of seeking
+        self.dedupe_distance = dedupe_distance
+        self._cache = OrderedDict()  # video key -> {time_point: (hash, base64 jpeg)}
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def _decode(self, video_path, time_points):
+        samples = {}
+        video = cv2.VideoCapture(video_path)
+        try:
+            fps = video.get(cv2.CAP_PROP_FPS)
+            if not fps:
+                return samples
+
+            position = None  # frame number the next grab() returns
+            for time_point in sorted(time_points):
+                frame_number = int(time_point * fps)
+                if position is None or frame_number < position or frame_number - position > self.max_grab_gap * fps:
+                    video.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                    position = frame_number
+
+                success = True
+                while position <= frame_number and success:
+                    success = video.grab()
+                    position += 1
+                if not success:
+                    break
+
+                success, frame = video.retrieve()
+                if not success:
+                    continue
+                frame = resize_for_vision(frame)
+                _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                samples[time_point] = (dhash(frame), base64.b64encode(buffer).decode("utf-8"))
+        finally:
+            video.release()
+        return samples
+
+    def _store(self, key, samples):
+        with self._lock:
+            entry = self._cache.setdefault(key, {})
+            for time_point, sample in samples.items():
+                if time_point not in entry:
+                    entry[time_point] = sample
+                    self._cache_bytes += len(sample[1])
+            self._cache.move_to_end(key)
+            while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= sum(len(sample[1]) for sample in evicted.values())
+
+    def sample(self, video_path, start_time, end_time, interval=2):
+        # returns base64 JPEG frames for range(start, end, interval), near-duplicates removed
+        time_points = list(range(int(start_time), int(end_time), interval))
+        if not time_points:
+            return []
+
+        key = video_key(video_path)
+        with self._lock:
+            cached = dict(self._cache.get(key, {}))
+        missing = [t for t in time_points if t not in cached]
+        if missing:
+            decoded = self._decode(video_path, missing)
+            self._store(key, decoded)
+            cached.update(decoded)
+
+        base64Frames = []
+        last_hash = None
+        for time_point in time_points:
+            sample = cached.get(time_point)
+            if sample is None:
+                continue
+            frame_hash, frame_base64 = sample
+            if last_hash is not None and bin(frame_hash ^ last_hash).count('1') <= self.dedupe_distance:
+                continue
+            last_hash = frame_hash
+            base64Frames.append(frame_base64)
+        return base64Frames
+
+frame_sampler = FrameSampler(
+    max_cache_bytes=getattr(settings, 'FRAME_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    dedupe_distance=getattr(settings, 'FRAME_DEDUPE_DISTANCE', 4),
+)
@@ -0,0 +1,118 @@
+# job_handlers.py
+# Handlers of the background job kinds. Kept out of views.py, which calls django.setup()
+# on import, so AppConfig.ready() and run_job_workers can register them.
+import os
+import json
+import tempfile
+
+from .openai_views import generate_summary
+from .transcription import transcribe_audio
+from .frame_sampler import frame_sampler
+from .audio_cache import audio_cache, extract_audio_track
+from .jobs import register_job
+from .uploads import is_persisted_upload, remove_persisted_upload
+
+def summarize_meta_item(video_path, meta_item, doc_meta_tmp, languagestr='en', job=None):
+    base64Frames = []
+
+    # Extract frames within the start and end times
+    start_time = meta_item.get('start')
+    end_time = meta_item.get('end')
+    if start_time is not None and end_time is not None:
+        base64Frames = frame_sampler.sample(video_path, start_time, end_time, interval=2)
+    if job: job.set_progress(0.3, 'frames extracted')
+
+    # Extract audio from video (once per video, later meta items reuse the file)
+    audio_path = audio_cache.extract(video_path)
+    if job: job.set_progress(0.6, 'audio extracted')
+
+    # Generate summary
+    transcript_data = "\n".join([item['text'] for item in doc_meta_tmp])
+    extra_info = f"The abstract of this video is {meta_item['text']}."
+    summary = generate_summary(base64Frames, transcript_data, extra_info, languagestr)
+
+    meta_item['text'] = summary  # Update the summary in meta_item
+
+    return {
+        'meta_item': meta_item,
+        'base64Frames': base64Frames,
+        'audio_path': audio_path
+    }
+
+def transcribe_video(video_path, temp_dir, job=None):
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3', dir=temp_dir) as temp_output_file:
+        temp_output_file_name = temp_output_file.name
+
+    try:
+        if not extract_audio(video_path, temp_output_file_name):
+            raise ValueError(f"Failed to extract audio from {video_path}")
+        print(f"temp_output_file_name: {temp_output_file_name}")
+        if job: job.set_progress(0.1, 'audio extracted')
+
+        progress = (lambda done: job.set_progress(0.1 + 0.9 * done, 'transcribing')) if job else None
+        return extract_and_concatenate_segments(transcribe_audio(temp_output_file_name, temp_dir, progress))
+    finally:
+        os.remove(temp_output_file_name)
+
+def extract_audio(input_file,output_file):
+    file_extension = os.path.splitext(input_file)[1].lower()
+
+    if file_extension in (".mp4", ".avi", ".mkv"):
+        try:
+            extract_audio_track(input_file, output_file, ['-ar', '44100'])
+            print(f"Audio extracted from video and saved as {output_file}")
+            return True
+        except Exception as e:
+            print(f"(extract_audio) Error: {e}")
+            return False
+    elif file_extension in (".mp3", ".m4a",".wav"):
+        print("Input file is already an audio file.")
+        return False
+    else:
+        print("Unsupported file format.")
+        return False
+    
+def extract_and_concatenate_segments(transcripts):
+    concatenated_segments = []
+    max_id = 0
+
+    for chunk, translation in transcripts:
+        # segment times are relative to the chunk, chunk['offset'] is where it starts in the audio
+        offset = chunk['offset']
+        for segment in translation.segments:
+            start = segment['start'] + offset
+            end = segment['end'] + offset
+
+            # the padded overlap belongs to the neighbouring chunk
+            if not chunk['keep_start'] <= (start + end) / 2 < chunk['keep_end']:
+                continue
+
+            concatenated_segments.append({
+                "id": max_id,
+                "start": start,
+                "end": end,
+                "content": segment['text']
+            })
+            max_id += 1
+
+    return json.dumps(concatenated_segments, ensure_ascii=False, indent=4)
+
+########################
+# background jobs
+
+def remove_video_upload(video_path, **params):
+    # on_cancel hook: a queued upload job that never runs leaves its persisted copy behind
+    remove_persisted_upload(video_path)
+
+@register_job('extract_text_from_video', on_cancel=remove_video_upload)
+def extract_text_from_video_job(job, video_path, temp_dir, doc_md5=None):
+    if not is_persisted_upload(video_path):
+        raise ValueError(f"{video_path} is not a persisted upload")
+    try:
+        return {'transcripts': transcribe_video(video_path, temp_dir, job), 'doc_md5': doc_md5}
+    finally:
+        remove_persisted_upload(video_path)
+
+@register_job('process_meta_item')
+def process_meta_item_job(job, video_path, meta_item, doc_meta_tmp, languagestr='en'):
+    return summarize_meta_item(video_path, meta_item, doc_meta_tmp, languagestr, job)
@@ -0,0 +1,235 @@
+# jobs.py
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+
+from .userdb import user_db_pool
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_handlers = {}
+_cancel_hooks = {}
+
+class JobCancelled(BaseException):
+    # BaseException so the broad "except Exception" blocks in the handlers don't swallow it
+    pass
+
+def register_job(kind, on_cancel=None):
+    '''
+    Registers handler(job, **params) for a job kind. The return value must be
+    JSON serialisable and becomes the job result.
+    on_cancel(**params) is called when a job is cancelled before a worker
+    picked it up, to release what the handler would have cleaned up.
+    '''
+    def decorator(func):
+        _handlers[kind] = func
+        if on_cancel is not None:
+            _cancel_hooks[kind] = on_cancel
+        return func
+    return decorator
+
+class JobContext:
+    # passed to handlers for progress reporting and cooperative cancellation
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def set_progress(self, progress, message=None):
+        self.queue.update_progress(self.job_id, progress, message)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.queue.cancel_requested(self.job_id):
+            raise JobCancelled()
+
+class JobQueue:
+    '''
+    SQLite-backed job queue with a pool of worker threads.
+    Any process pointing at the same file can submit, inspect or cancel jobs;
+    workers claim queued jobs one at a time inside an IMMEDIATE transaction.
+    '''
+
+    def __init__(self, path, workers=2, poll_interval=1.0):
+        self.path = path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, '
+            'status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, message TEXT, '
+            'result TEXT, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, '
+            'worker_pid INTEGER, created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL;')
+            conn.execute('PRAGMA synchronous = NORMAL;')
+            self._local.conn = conn
+        return conn
+
+    ########## client side
+
+    def submit(self, kind, **params):
+        if kind not in _handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            'INSERT INTO jobs (job_id, kind, params, status, created_at) VALUES (?, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(params), QUEUED, time.time()),
+        )
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        row = self._connection().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    def cancel(self, job_id):
+        # queued jobs are cancelled right away, running jobs at their next checkpoint
+        conn = self._connection()
+        dequeued = conn.execute(
+            'UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ? WHERE job_id = ? AND status = ?',
+            (CANCELLED, time.time(), job_id, QUEUED),
+        ).rowcount
+        conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?', (job_id, RUNNING))
+        job = self.get(job_id)
+        if dequeued and job['kind'] in _cancel_hooks:
+            # the handler will never run, so neither will its own cleanup
+            try:
+                _cancel_hooks[job['kind']](**job['params'])
+            except Exception:
+                logging.exception(f"(JobQueue) cancel hook for job {job_id} ({job['kind']}) failed")
+        return job
+
+    ########## worker side
+
+    def update_progress(self, job_id, progress, message=None):
+        self._connection().execute(
+            'UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE job_id = ?',
+            (min(max(float(progress), 0.0), 1.0), message, job_id),
+        )
+
+    def cancel_requested(self, job_id):
+        row = self._connection().execute('SELECT cancel_requested FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _claim(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT job_id, kind, params FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, started_at = ?, worker_pid = ? WHERE job_id = ?',
+                    (RUNNING, time.time(), os.getpid(), row['job_id']),
+                )
+            conn.execute('COMMIT')
+            return row
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._connection().execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, '
+            'progress = CASE WHEN ? = ? THEN 1 ELSE progress END WHERE job_id = ?',
+            (status, json.dumps(result) if result is not None else None, error, time.time(), status, SUCCEEDED, job_id),
+        )
+
+    def _run_job(self, row):
+        job_id = row['job_id']
+        try:
+            handler = _handlers[row['kind']]
+            result = handler(JobContext(self, job_id), **json.loads(row['params']))
+            self._finish(job_id, SUCCEEDED, result=result)
+        except JobCancelled:
+            self._finish(job_id, CANCELLED)
+        except Exception as e:
+            logging.exception(f"(JobQueue) job {job_id} ({row['kind']}) failed")
+            self._finish(job_id, FAILED, error=str(e))
+        finally:
+            close_old_connections()
+            # worker threads never see a request boundary
+            user_db_pool.close_evicted_connections()
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.OperationalError as e:
+                logging.warning(f"(JobQueue) claim failed: {e}")
+                row = None
+            if row is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run_job(row)
+
+    def requeue_orphans(self):
+        # running jobs whose worker process is gone are put back in the queue
+        conn = self._connection()
+        for row in conn.execute('SELECT job_id, worker_pid FROM jobs WHERE status = ?', (RUNNING,)).fetchall():
+            pid = row['worker_pid']
+            try:
+                if pid:
+                    os.kill(pid, 0)
+                    continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            conn.execute('UPDATE jobs SET status = ?, worker_pid = NULL WHERE job_id = ? AND status = ?', (QUEUED, row['job_id'], RUNNING))
+
+    def start(self):
+        with self._start_lock:
+            if self._started or self.workers <= 0:
+                return
+            self.requeue_orphans()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+job_queue = JobQueue(
+    getattr(settings, 'JOB_QUEUE_PATH', os.path.join(settings.BASE_DIR, 'master', 'jobs.sqlite3')),
+    workers=getattr(settings, 'JOB_WORKERS', os.cpu_count() or 2),
+)
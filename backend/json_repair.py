@@ -0,0 +1,274 @@
+# json_repair.py
+import re
+import json
+import threading
+
+FENCE_RE = re.compile(r'^\s*```[a-zA-Z0-9_-]*\s*\n?(.*?)\n?\s*```\s*$', re.S)
+BARE_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null', 'undefined': 'null', 'NaN': 'null'}
+# an unquoted value runs to the end of the member, an unquoted key to its colon
+VALUE_STOP = set(',}]\n"')
+KEY_STOP = set(':,{}[]\n"\'')
+# an unquoted value with a bracket, a quote or a "key: " in it is broken JSON rather than text
+VALUE_AMBIGUOUS_RE = re.compile(r'[{\["]|:(\s|$)')
+LITERAL_WORDS = ('true', 'false', 'null', 'none', 'undefined', 'nan')
+NUMBERISH_RE = re.compile(r'[-+]?\.?[0-9]')
+CLOSERS = {'{': '}', '[': ']'}
+
+class JSONRepairError(ValueError):
+    pass
+
+class _Repairer:
+    '''
+    Single pass over the text that re-emits it as JSON. Each open object or
+    array remembers what it expects next ('key', 'colon', 'value', 'comma'),
+    which is enough to drop trailing and doubled commas, insert missing ones,
+    quote bare keys, and close whatever a truncated text left open.
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.out = []
+        self.stack = []  # [bracket, expect]
+        self.done = False
+
+    def expect(self):
+        return self.stack[-1][1] if self.stack else 'value'
+
+    def set_expect(self, expect):
+        if self.stack:
+            self.stack[-1][1] = expect
+
+    def after_value(self):
+        if self.stack:
+            self.set_expect('comma')
+        else:
+            self.done = True
+
+    def before_item(self):
+        # a value or key where a comma or colon was due: it is missing
+        if self.expect() == 'comma':
+            self.out.append(',')
+            self.set_expect('key' if self.stack[-1][0] == '{' else 'value')
+        elif self.expect() == 'colon':
+            self.out.append(':')
+            self.set_expect('value')
+
+    def drop_trailing_comma(self):
+        i = len(self.out) - 1
+        while i >= 0 and self.out[i].isspace():
+            i -= 1
+        if i >= 0 and self.out[i] == ',':
+            del self.out[i]
+
+    def finish_member(self):
+        # an object member cut short before the value
+        if not self.stack or self.stack[-1][0] != '{':
+            return
+        if self.expect() == 'colon':
+            self.out.append(':null')
+        elif self.expect() == 'value':
+            self.out.append('null')
+        else:
+            return
+        self.set_expect('comma')
+
+    def close(self):
+        self.finish_member()
+        self.drop_trailing_comma()
+        bracket, _ = self.stack.pop()
+        self.out.append(CLOSERS[bracket])
+        self.after_value()
+
+    def read_string(self, quote):
+        chars = []
+        self.pos += 1
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == '\\' and self.pos + 1 < len(self.text):
+                nxt = self.text[self.pos + 1]
+                if quote == "'" and nxt == "'":
+                    chars.append("'")
+                else:
+                    chars.append(c + nxt)
+                self.pos += 2
+                continue
+            self.pos += 1
+            if c == quote:
+                break
+            if c == '"':
+                chars.append('\\"')
+            elif c == '\n':
+                chars.append('\\n')
+            elif c == '\t':
+                chars.append('\\t')
+            elif c == '\r':
+                chars.append('\\r')
+            else:
+                chars.append(c)
+        # an unterminated string (truncated text) is closed here
+        return '"' + ''.join(chars) + '"'
+
+    def at_comment(self, start):
+        # "//" or "/*" starting a token or after whitespace, so a URL stays intact
+        return (
+            self.text.startswith(('//', '/*'), self.pos)
+            and (self.pos == start or self.text[self.pos - 1].isspace())
+        )
+
+    def skip_comment(self):
+        if self.text.startswith('//', self.pos):
+            end = self.text.find('\n', self.pos)
+            self.pos = len(self.text) if end == -1 else end
+        else:
+            end = self.text.find('*/', self.pos + 2)
+            self.pos = len(self.text) if end == -1 else end + 2
+
+    def read_bare(self, stop):
+        start = self.pos
+        while self.pos < len(self.text) and self.text[self.pos] not in stop and not self.at_comment(start):
+            self.pos += 1
+        return self.text[start:self.pos].strip()
+
+    def bare_value(self, token, start):
+        # the JSON text for an unquoted value, or an error when its meaning is a guess
+        token = BARE_LITERALS.get(token, token)
+        if token in ('true', 'false', 'null'):
+            return token
+        if NUMBERISH_RE.match(token):
+            try:
+                json.loads(token)
+                return token
+            except ValueError:
+                raise JSONRepairError(f"ambiguous number {token!r} at {start}")
+        if any(word.startswith(token.lower()) for word in LITERAL_WORDS):
+            raise JSONRepairError(f"ambiguous literal {token!r} at {start}")
+        if VALUE_AMBIGUOUS_RE.search(token):
+            raise JSONRepairError(f"ambiguous unquoted value {token!r} at {start}")
+        return json.dumps(token)
+
+    def check_trailing(self):
+        # after the root value only whitespace and comments may follow
+        while self.pos < len(self.text):
+            if self.text[self.pos].isspace():
+                self.pos += 1
+            elif self.at_comment(self.pos):
+                self.skip_comment()
+            else:
+                raise JSONRepairError(f"unexpected trailing content at {self.pos}")
+
+    def repair(self):
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            c = text[self.pos]
+            expect = self.expect()
+
+            if c.isspace():
+                self.out.append(c)
+                self.pos += 1
+            elif c in '"\'':
+                self.before_item()
+                self.out.append(self.read_string(c))
+                if self.expect() == 'key':
+                    self.set_expect('colon')
+                else:
+                    self.after_value()
+            elif c in '{[':
+                self.before_item()
+                if self.expect() == 'key':
+                    raise JSONRepairError(f"unexpected {c!r} at {self.pos}")
+                self.out.append(c)
+                self.stack.append([c, 'key' if c == '{' else 'value'])
+                self.pos += 1
+            elif c in '}]':
+                self.pos += 1
+                if not any(bracket == ('{' if c == '}' else '[') for bracket, _ in self.stack):
+                    continue  # stray closer
+                while self.stack[-1][0] != ('{' if c == '}' else '['):
+                    self.close()
+                self.close()
+            elif c == ',':
+                self.pos += 1
+                if expect == 'comma':
+                    self.out.append(',')
+                    self.set_expect('key' if self.stack[-1][0] == '{' else 'value')
+                elif expect in ('colon', 'value') and self.stack and self.stack[-1][0] == '{':
+                    # "key", / "key": , -> "key": null,
+                    self.out.append(':null,' if expect == 'colon' else 'null,')
+                    self.set_expect('key')
+            elif c == ':':
+                self.pos += 1
+                if expect == 'colon':
+                    self.out.append(':')
+                    self.set_expect('value')
+            elif self.at_comment(self.pos):
+                self.skip_comment()
+            else:
+                self.before_item()
+                start = self.pos
+                if self.expect() == 'key':
+                    token = self.read_bare(KEY_STOP)
+                    if not token:
+                        raise JSONRepairError(f"unexpected {c!r} at {start}")
+                    self.out.append(json.dumps(token))
+                    self.set_expect('colon')
+                    continue
+                self.out.append(self.bare_value(self.read_bare(VALUE_STOP), start))
+                self.after_value()
+
+        if self.done:
+            self.check_trailing()
+        # whatever is still open was cut off
+        while self.stack:
+            self.close()
+        return ''.join(self.out).strip()
+
+def strip_code_fence(text):
+    match = FENCE_RE.match(text)
+    return match.group(1) if match else text
+
+def repair_json(text):
+    '''
+    Returns (obj, repaired): the parsed value and whether the text needed
+    repair. Handles code fences, truncation, unbalanced brackets, trailing or
+    missing commas, single quotes, unquoted keys and values, and Python
+    literals. Raises JSONRepairError when the text can't be turned into JSON
+    or a repair would have to guess: content after the root value, cut-off
+    literals like `tru`, numbers like `01`, or unquoted values that contain
+    JSON syntax.
+    '''
+    text = strip_code_fence(text.strip())
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+
+    start = min((i for i in (text.find('{'), text.find('[')) if i != -1), default=-1)
+    if start == -1:
+        raise JSONRepairError("no JSON object or array found")
+
+    repaired = _Repairer(text[start:]).repair()
+    try:
+        return json.loads(repaired), True
+    except ValueError as e:
+        raise JSONRepairError(str(e))
+
+class RepairMetrics:
+    # which path json_completer took: valid as is, repaired locally, or sent to the model
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'valid': 0, 'repaired': 0, 'llm': 0}
+
+    def record(self, path):
+        with self._lock:
+            self.counts[path] += 1
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                **self.counts,
+                'local_rate': (self.counts['valid'] + self.counts['repaired']) / total if total else 0.0,
+            }
+
+repair_metrics = RepairMetrics()
@@ -0,0 +1,24 @@
+# llm_clients.py
+import os
+import httpx
+import openai
+from dotenv import load_dotenv
+from django.conf import settings
+
+load_dotenv(dotenv_path='.env.local', override=True)
+
+# One AsyncOpenAI client per process. Its httpx pool is sized for hundreds of
+# concurrent in-flight completions under the ASGI server (backend/asgi.py);
+# it must only be used from that server's event loop.
+async_client = openai.AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=getattr(settings, 'OPENAI_MAX_RETRIES', 2),
+    http_client=openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=getattr(settings, 'OPENAI_MAX_CONNECTIONS', 500),
+            max_keepalive_connections=getattr(settings, 'OPENAI_MAX_KEEPALIVE_CONNECTIONS', 100),
+            keepalive_expiry=30,
+        ),
+        timeout=httpx.Timeout(getattr(settings, 'OPENAI_TIMEOUT', 600), connect=10.0),
+    ),
+)
@@ -0,0 +1,45 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = ('Creates the missing scalar, full-text and vector indexes of the RAG tables in the master '
+            'and every per-user LanceDB, e.g. for tables written before an index type existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', help='Only these users (default: master and all users)')
+
+    def handle(self, *args, **options):
+        from backend.vectordb import LANCEDB_URI, lance_cache, user_lancedb_uri
+        from backend.vector_index import FTS_COLUMNS, SCALAR_INDEXES, index_manager
+
+        user_ids = options['user_ids']
+        uris = [user_lancedb_uri(user_id) for user_id in user_ids]
+        if not user_ids:
+            uris.append(LANCEDB_URI)
+            root = os.path.join(settings.BASE_DIR, 'userdbs')
+            if os.path.isdir(root):
+                uris.extend(
+                    user_lancedb_uri(name) for name in sorted(os.listdir(root))
+                    if os.path.isdir(os.path.join(root, name, 'lancedb'))
+                )
+
+        table_names = set(FTS_COLUMNS) | set(SCALAR_INDEXES)
+        failed = 0
+        for uri in uris:
+            try:
+                existing = set(lance_cache.connect(uri).table_names())
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{uri}: {e}')
+                continue
+            for table_name in sorted(table_names & existing):
+                try:
+                    index_manager.ensure_indexes(uri, table_name)
+                    self.stdout.write(f'{uri} {table_name}: indexed')
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{uri} {table_name}: {e}')
+            lance_cache.evict(uri)
+
+        self.stdout.write(f'{len(uris)} LanceDB databases checked, {failed} failures.')
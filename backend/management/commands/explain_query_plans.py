@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+class Command(BaseCommand):
+    help = ('Prints the SQLite query plan and average time of the hot document, chat log '
+            'and activity queries. Run it before and after migrating to compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Per-user database to inspect (default: the master database)')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query for the timing')
+
+    def handle(self, *args, **options):
+        from backend.models import Document, UserDocument, UserChatLog, UserActivityList
+        from backend.userdb import user_database_connection, apply_migrations_to_user_db
+
+        now = timezone.now()
+        visible = (
+            (Q(display_date__isnull=True) | Q(display_date__lte=now)),
+            (Q(expire_date__isnull=True) | Q(expire_date__gte=now)),
+        )
+
+        user_id = options['user']
+        if user_id:
+            db_name = user_database_connection(user_id)
+            apply_migrations_to_user_db(connections[db_name], db_name)
+            documents = UserDocument.objects.using(db_name)
+            queries = {
+                'chat log, newest first': UserChatLog.objects.using(db_name).order_by('-create_time')[:20],
+                'pending activities': UserActivityList.objects.using(db_name).filter(user_id=user_id, check_flag=0),
+                'pending activities since': UserActivityList.objects.using(db_name).filter(
+                    user_id=user_id, check_flag=0, create_date__gte=now),
+                'activity by session': UserActivityList.objects.using(db_name).filter(user_id=user_id, session_id=''),
+            }
+        else:
+            db_name = 'default'
+            documents = Document.objects.using(db_name)
+            queries = {}
+
+        queries.update({
+            'documents by file_type, page': documents.filter(file_type='videos').order_by('doc_createdate', 'doc_id')[:100],
+            'documents, page': documents.order_by('doc_createdate', 'doc_id')[:100],
+            'visible documents': documents.filter(*visible).order_by('doc_createdate'),
+        })
+
+        connection = connections[db_name]
+        for label, queryset in queries.items():
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                elapsed = (time.perf_counter() - start) / max(options['repeat'], 1)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{label} ({elapsed * 1000:.2f} ms)'))
+            for step in plan:
+                self.stdout.write(f'  {step}')
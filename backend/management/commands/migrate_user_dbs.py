@@ -0,0 +1,36 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+class Command(BaseCommand):
+    help = 'Applies pending backend migrations to every per-user database under userdbs/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', help='Only these users (default: all)')
+
+    def handle(self, *args, **options):
+        from backend.userdb import user_database_connection, apply_migrations_to_user_db, user_db_pool
+
+        user_ids = options['user_ids']
+        root = os.path.join(settings.BASE_DIR, 'userdbs')
+        if not user_ids and os.path.isdir(root):
+            user_ids = sorted(
+                name for name in os.listdir(root)
+                if os.path.isfile(os.path.join(root, name, f'{name}.sqlite3'))
+            )
+
+        failed = 0
+        for user_id in user_ids:
+            db_name = user_database_connection(user_id)
+            try:
+                apply_migrations_to_user_db(connections[db_name], db_name)
+                self.stdout.write(f'{user_id}: up to date')
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{user_id}: {e}')
+            finally:
+                # one open handle per user is not needed here
+                user_db_pool.evict(db_name)
+
+        self.stdout.write(f'{len(user_ids) - failed}/{len(user_ids)} user databases migrated.')
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = 'Runs background job workers (video ingestion) outside the web process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker threads (default: JOB_WORKERS)')
+
+    def handle(self, *args, **options):
+        from backend import job_handlers  # registers the job handlers
+        from backend.jobs import job_queue
+
+        if options['workers']:
+            job_queue.workers = options['workers']
+        if job_queue.workers <= 0:
+            job_queue.workers = 1
+
+        job_queue.start()
+        self.stdout.write(f'Running {job_queue.workers} job workers, press CTRL+C to stop.')
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            job_queue.stop()
@@ -32,8 +32,11 @@ class User(AbstractUser):
 def documents_upload_uri(instance, filename):
     return f'{instance.file_type}/{instance.doc_id}.{instance.doc_type}'
     
+def thumbnail_extension(filename):
+    return os.path.splitext(filename)[1] or '.png'
+
 def image_upload_uri(instance, filename):
-    return f'{instance.file_type}/thumbnails/{instance.doc_id}_thumbnail.png'
+    return f'{instance.file_type}/thumbnails/{instance.doc_id}_thumbnail{thumbnail_extension(filename)}'
 
 class Document(models.Model):
     doc_id = models.CharField(max_length=1000, editable=False, unique=True, primary_key=True)
@@ -56,6 +59,16 @@ class Document(models.Model):
     file = models.FileField(upload_to=documents_upload_uri, null=True)
     thumbnail = models.ImageField(upload_to=image_upload_uri, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # list_documents keyset pagination, with and without a file_type / user filter
+            models.Index(fields=['doc_createdate', 'doc_id'], name='document_created_idx'),
+            models.Index(fields=['file_type', 'doc_createdate', 'doc_id'], name='document_type_created_idx'),
+            models.Index(fields=['user', 'file_type', 'doc_createdate'], name='document_user_type_idx'),
+            # display_documents window
+            models.Index(fields=['display_date', 'expire_date'], name='document_display_idx'),
+        ]
+
     def __str__(self):
         return self.doc_title
     
@@ -68,7 +81,7 @@ def user_documents_upload_uri(instance, filename):
     
 def user_image_upload_uri(instance, filename):
     # user_id = instance.user.line_user_id
-    return os.path.join(instance.user_id, instance.file_type, 'thumbnails', f'{instance.doc_id}_thumbnail.png')
+    return os.path.join(instance.user_id, instance.file_type, 'thumbnails', f'{instance.doc_id}_thumbnail{thumbnail_extension(filename)}')
 
 class UserDocument(models.Model):
     doc_id = models.CharField(max_length=100, editable=False, unique=True, primary_key=True)
@@ -92,6 +105,13 @@ class UserDocument(models.Model):
     file = models.FileField(upload_to=user_documents_upload_uri, storage=UserDocumentStorage(), null=True)
     thumbnail = models.ImageField(upload_to=user_image_upload_uri, storage=UserDocumentStorage(), blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['doc_createdate', 'doc_id'], name='userdoc_created_idx'),
+            models.Index(fields=['file_type', 'doc_createdate', 'doc_id'], name='userdoc_type_created_idx'),
+            models.Index(fields=['display_date', 'expire_date'], name='userdoc_display_idx'),
+        ]
+
     def __str__(self):
         return self.doc_title
     
@@ -104,6 +124,12 @@ class UserChatLog(models.Model):
     dialog_text = models.TextField(null=True, blank=True)
     dialog_meta = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # chat logs are always read newest first
+            models.Index(fields=['-create_time'], name='userchatlog_create_time_idx'),
+        ]
+
     def __str__(self):
         return f"ChatLog for {self.user_id} (Session: {self.dialog_session_id})"
     
@@ -125,5 +151,13 @@ class UserActivityList(models.Model):
     finish_date = models.DateTimeField(null=True, blank=True)
     session_id = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            # get_activities: user_id + check_flag, optionally since create_date
+            models.Index(fields=['user_id', 'check_flag', 'create_date'], name='activity_user_check_idx'),
+            # insert_activity: update_or_create(user_id=..., session_id=...)
+            models.Index(fields=['user_id', 'session_id'], name='activity_user_session_idx'),
+        ]
+
     def __str__(self):
         return f"Activity {self.activity_id} for User {self.user_id}"
\ No newline at end of file
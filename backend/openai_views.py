@@ -8,12 +8,231 @@ import json
 import openai
 import os
 import logging
-from .utils import lang_detect, calculate_tokens
-import lancedb
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .utils import lang_detect, calculate_tokens, trim_to_tokens, get_encoding
+from .embeddings import embedding_service
+from .vectordb import get_master_table
+from .vector_index import apply_search_params
+from .streaming import stream_chat_completion_for
+from .llm_clients import async_client
+from .completion_cache import completion_cache, CACHE_MODES
+from .json_repair import repair_json, repair_metrics, JSONRepairError
 
 client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-LANCEDB_URI = "master/lancedb/"
+
+# Define the context window size for each model
+MODEL_TOKEN_INPUT_LIMITS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+}
+
+def image_question_messages(image_path, question):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": question},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_path,
+                        "detail": "high"
+                   },
+                },
+            ],
+        }
+    ]
+
+# map-reduce descriptions: sections are summarised with these rules before the
+# partial summaries are merged under the caller's AI_rules
+MAP_SECTION_RULES = (
+    "You summarise one section of a longer document. The summary will be merged with "
+    "the summaries of the other sections, so keep the key facts, names and figures."
+)
+MAP_REDUCE_MAX_ROUNDS = 4
+DESCRIPTION_MODES = ('truncate', 'map_reduce', 'auto')
+
+class DescriptionBudgetError(ValueError):
+    # the request's token limits leave no room for the requested mode, a client error
+    pass
+
+def description_language(text, lang_mode):
+    if lang_mode == 1:
+        # Determine the language of the input text
+        mylang = lang_detect(text[0:200])
+
+        return f"Please output in {mylang}, your answer:"
+    return ""
+
+def description_budget(model_name, max_tokens, max_output_tokens):
+    # Define the maximum number of tokens for the model
+    if max_tokens > 0:
+        max_total_tokens = max_tokens
+    else:
+        max_total_tokens = MODEL_TOKEN_INPUT_LIMITS[model_name] * 0.5
+
+    return max_total_tokens, int(max_total_tokens - max_output_tokens)
+
+def description_payload(text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, languagestr=None):
+    '''
+    Builds the generate_description messages, trimming the text to the input budget.
+    Returns (messages_payload, max_total_tokens).
+    '''
+    if languagestr is None:
+        languagestr = description_language(text, lang_mode)
+
+    max_total_tokens, max_input_tokens = description_budget(model_name, max_tokens, max_output_tokens)
+
+    # The text is encoded once and, if the prompt is too long, cut at the exact
+    # token where the input budget runs out
+    wrapper_tokens = calculate_tokens(f"\n\n\n\n{languagestr}", model_name)
+    trimmed_text, _ = trim_to_tokens(text, max_input_tokens - wrapper_tokens, model_name)
+    prompt = f"\n\n{trimmed_text}\n\n{languagestr}"
+
+    messages_payload = [
+        {"role": "system", "content": AI_rules},
+        {"role": "user", "content": prompt}
+    ]
+    return messages_payload, max_total_tokens
+
+def use_map_reduce(mode, text, model_name, max_tokens, max_output_tokens):
+    if mode not in DESCRIPTION_MODES:
+        raise ValueError(f"mode must be one of {', '.join(DESCRIPTION_MODES)}")
+    if mode == 'auto':
+        _, max_input_tokens = description_budget(model_name, max_tokens, max_output_tokens)
+        return calculate_tokens(text, model_name) > max_input_tokens
+    return mode == 'map_reduce'
+
+def map_section_budget(model_name, max_tokens, max_output_tokens):
+    # tokens of document text per map call
+    _, max_input_tokens = description_budget(model_name, max_tokens, max_output_tokens)
+    section_tokens = max_input_tokens - calculate_tokens(MAP_SECTION_RULES, model_name) - 16  # "Section i of n" header
+    if section_tokens <= 2 * max_output_tokens:
+        raise DescriptionBudgetError("max_tokens is too small for map-reduce, the partial summaries would not shrink the text")
+    return section_tokens
+
+def split_sections(text, section_tokens, model_name):
+    enc = get_encoding(model_name)
+    tokens = enc.encode(text, disallowed_special=())
+    return [enc.decode(tokens[i:i + section_tokens]) for i in range(0, len(tokens), section_tokens)]
+
+def map_section_messages(section, index, count):
+    return [
+        {"role": "system", "content": MAP_SECTION_RULES},
+        {"role": "user", "content": f"Section {index + 1} of {count}:\n\n{section}"},
+    ]
+
+def join_partial_summaries(partials):
+    return "\n\n".join(f"Section {i + 1}:\n{partial}" for i, partial in enumerate(partials))
+
+def reduce_messages(partial_summaries, AI_rules, languagestr):
+    return [
+        {"role": "system", "content": AI_rules},
+        {"role": "user", "content": f"\n\nThe following are summaries of the consecutive sections of one document.\n\n{partial_summaries}\n\n{languagestr}"},
+    ]
+
+def new_stage(name):
+    return {'stage': name, 'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0,
+            'latency_ms': 0.0, 'slowest_call_ms': 0.0}
+
+def record_call(stage, completions, elapsed):
+    stage['calls'] += 1
+    stage['prompt_tokens'] += completions.usage.prompt_tokens
+    stage['completion_tokens'] += completions.usage.completion_tokens
+    stage['total_tokens'] += completions.usage.total_tokens
+    stage['slowest_call_ms'] = max(stage['slowest_call_ms'], round(elapsed * 1000, 1))
+
+def map_reduce_description(text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, cache_mode='use'):
+    '''
+    Summarises every section of a text that is over the input budget instead of
+    dropping the tail: sections are summarised concurrently (map), and the
+    partial summaries are merged in a final call (reduce). Partial summaries that
+    are still over budget are mapped again.
+    Returns (description, stages) with the token usage and latency of each stage.
+    '''
+    languagestr = description_language(text, lang_mode)
+    section_tokens = map_section_budget(model_name, max_tokens, max_output_tokens)
+
+    def timed_completion(messages):
+        start = time.perf_counter()
+        completions = completion_cache.create(
+            client, cache_mode,
+            model=model_name,
+            messages=messages,
+            max_tokens=max_output_tokens,
+            temperature=0.0
+        )
+        return completions, time.perf_counter() - start
+
+    stages = []
+    content = text
+    for round_index in range(MAP_REDUCE_MAX_ROUNDS):
+        sections = split_sections(content, section_tokens, model_name)
+        if len(sections) <= 1:
+            break
+
+        stage = new_stage(f"map_{round_index + 1}")
+        start = time.perf_counter()
+        workers = min(len(sections), getattr(settings, 'DESCRIPTION_MAP_WORKERS', 8))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                timed_completion,
+                [map_section_messages(section, i, len(sections)) for i, section in enumerate(sections)],
+            ))
+        for completions, elapsed in results:
+            record_call(stage, completions, elapsed)
+        stage['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        stages.append(stage)
+
+        content = join_partial_summaries([completions.choices[0].message.content for completions, _ in results])
+
+    if stages:
+        messages_payload = reduce_messages(content, AI_rules, languagestr)
+    else:
+        # short enough for a single call
+        messages_payload, _ = description_payload(content, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, languagestr)
+
+    stage = new_stage("reduce")
+    start = time.perf_counter()
+    complete_response = ""
+    while True:
+        completions, elapsed = timed_completion(messages_payload)
+        record_call(stage, completions, elapsed)
+        complete_response += completions.choices[0].message.content
+        if not continue_description(completions, messages_payload) or stage['calls'] >= MAP_REDUCE_MAX_ROUNDS:
+            break
+    stage['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    stages.append(stage)
+
+    return complete_response, stages
+
+def continue_description(completions, messages_payload):
+    '''
+    Returns True and extends the payload when the output was cut off by max_tokens.
+    '''
+    if completions.choices[0].finish_reason == "length":
+        messages_payload.append({"role": "assistant", "content": completions.choices[0].message.content})
+        messages_payload.append({"role": "user", "content": "Please continue the output from the end of the word of the previous response"})
+        return True
+    return False
+
+def rag_messages_payload(context, messages, messages_embedding, data):
+    tbl = get_master_table("Research_paper_table")
+
+    # cosine to match the IVF-PQ index, the ranking is the same as L2 for normalized embeddings
+    query = tbl.search(messages_embedding, vector_column_name='vector').metric("cosine").limit(5)
+    search_results = apply_search_params(query, 'generate_response_rag', data).to_df()
+    context_from_search = "\n".join(search_results['content'])
+
+    return [
+        {"role": "system", "content": f"{context} and use the following context as reference to answer: {context_from_search}"},
+        {"role": "user", "content": f"{messages}"},
+    ]
 
 @csrf_exempt
 @require_POST
@@ -28,21 +247,7 @@ def ask_question_about_image(request):
         
         completions = client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": question},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_path,
-                                "detail": "high"
-                           },
-                        },
-                    ],
-                }
-            ],
+            messages=image_question_messages(image_path, question),
             max_tokens=300,
         )
         response = completions.choices[0].message.content
@@ -60,7 +265,7 @@ def get_embedding(request):
             text = data.get('text')
             model = data.get('model', 'text-embedding-3-small')
 
-            embedding = client.embeddings.create(input = [text], model=model).data[0].embedding
+            embedding = embedding_service.embed_one(text, model=model)
 
             return JsonResponse({'embedding': embedding}, status=200)
         except Exception as e:
@@ -77,62 +282,31 @@ def generate_description(request):
         max_tokens = data.get('max_tokens', 0)
         max_output_tokens = data.get('max_output_tokens', 500)
         lang_mode = data.get('lang_mode', 1)
-
-        # Define the context window size for each model
-        model_token_input_limits = {
-            "gpt-3.5-turbo": 4096,
-            "gpt-4": 8192,
-            "gpt-4o": 128000,
-            "gpt-4-turbo": 128000,
-        }
+        mode = data.get('mode', 'truncate')
+        cache_mode = data.get('cache', 'use')
+        if mode not in DESCRIPTION_MODES:
+            return JsonResponse({'error': f"mode must be one of {', '.join(DESCRIPTION_MODES)}"}, status=400)
+        if cache_mode not in CACHE_MODES:
+            return JsonResponse({'error': f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
 
         try:
-            # Determine the language of the input text
-            mylang = lang_detect(text[0:200])
-
-            if lang_mode == 1:
-                # Determine the language of the input text
-                mylang = lang_detect(text[0:200])
-
-                languagestr = f"Please output in {mylang}, your answer:"
-            else:
-                languagestr = ""
-
-            prompt = f"\n\n{text}\n\n{languagestr}"
-
-            # Calculate the number of tokens in the prompt
-            prompt_tokens = calculate_tokens(prompt, model_name)
-
-            # Define the maximum number of tokens for the model
-            if max_tokens > 0:
-                max_total_tokens = max_tokens
-            else:
-                max_total_tokens = model_token_input_limits[model_name] * 0.5
-
-            max_output_tokens = max_output_tokens  # You can adjust this based on your needs
-            max_input_tokens = max_total_tokens - max_output_tokens
-
-            # If the prompt is too long, trim the input text
-            if prompt_tokens > max_input_tokens:
-                # Trim the text to fit within the input token limit
-                trimmed_text = text[:max_input_tokens - calculate_tokens(f"\n\n\n\n{languagestr}", model_name)]
-                trimmed_prompt = f"\n\n{trimmed_text}\n\n{languagestr}"
-                prompt_tokens = calculate_tokens(trimmed_prompt, model_name)
-                messages_payload = [
-                    {"role": "system", "content": AI_rules},
-                    {"role": "user", "content": trimmed_prompt}
-                ]
-            else:
-                messages_payload = [
-                    {"role": "system", "content": AI_rules},
-                    {"role": "user", "content": prompt}
-                ]
+            if use_map_reduce(mode, text, model_name, max_tokens, max_output_tokens):
+                description, stages = map_reduce_description(text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode, cache_mode)
+                return JsonResponse({
+                    'description': description,
+                    'mode': 'map_reduce',
+                    'stages': stages,
+                    'total_tokens': sum(stage['total_tokens'] for stage in stages),
+                }, status=200)
+
+            messages_payload, max_total_tokens = description_payload(text, AI_rules, model_name, max_tokens, max_output_tokens, lang_mode)
 
             complete_response = ""
             total_tokens_used = 0
             while True:
                 # Prepare the message payload with system prompts
-                completions = client.chat.completions.create(
+                completions = completion_cache.create(
+                    client, cache_mode,
                     model=model_name,
                     messages=messages_payload,
                     max_tokens=max_output_tokens,
@@ -151,13 +325,7 @@ def generate_description(request):
                     return None
 
                 # Check if the response is complete or if we need to continue
-                if completions.choices[0].finish_reason == "stop":
-                    break
-
-                if completions.choices[0].finish_reason == "length":
-                    messages_payload.append({"role": "assistant", "content": response})
-                    messages_payload.append({"role": "user", "content": "Please continue the output from the end of the word of the previous response"})
-                else:
+                if not continue_description(completions, messages_payload):
                     break
 
                 # Adjust the remaining tokens to avoid exceeding the limit
@@ -169,6 +337,8 @@ def generate_description(request):
             # response_content = complete_response
 
             return JsonResponse({'description': complete_response}, status=200)
+        except DescriptionBudgetError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'error': f"An error occurred while generating the description: {e}"}, status=500)
     return JsonResponse({'error': 'Invalid request method'}, status=400)
@@ -181,15 +351,23 @@ def generate_response(request):
         messages = data.get('messages', '')
         model = data.get('model', 'gpt-4o-2024-05-13')
         user_id = data.get('user_id', None)
+        stream = data.get('stream', False)
+        stream_format = data.get('stream_format', 'sse')
+        if data.get('cache', 'use') not in CACHE_MODES:
+            return JsonResponse({'error': f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
 
         messages_payload = [
             {"role": "system", "content": f"{context}"},
             {"role": "user", "content": f"{messages}"},
         ]
 
+        if stream:
+            return stream_chat_completion_for(request, client, async_client, stream_format, model=model, messages=messages_payload, temperature=0.0)
+
         try:
             # Make a request to OpenAI using the Chat Completion endpoint
-            completions = client.chat.completions.create(
+            completions = completion_cache.create(
+                client, data.get('cache', 'use'),
                 model=model,
                 messages=messages_payload,
                 temperature=0.0
@@ -216,25 +394,24 @@ def generate_response_rag(request):
         messages = data.get('messages', '')
         model = data.get('model', 'gpt-4o-2024-05-13')
         user_id = data.get('user_id', None)
+        stream = data.get('stream', False)
+        stream_format = data.get('stream_format', 'sse')
+        if data.get('cache', 'use') not in CACHE_MODES:
+            return JsonResponse({'error': f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
 
         last_input = messages[-1]['content']
-        db = lancedb.connect(f"{LANCEDB_URI}")
-        tbl = db.open_table("Research_paper_table")
 
         # simple lancedb rag
-        messages_embedding = client.embeddings.create(input = [last_input], model='text-embedding-3-small').data[0].embedding
-    
-        search_results = tbl.search(messages_embedding, vector_column_name='vector').limit(5).to_df()
-        context_from_search = "\n".join(search_results['content'])
+        messages_embedding = embedding_service.embed_one(last_input, model='text-embedding-3-small')
+        messages_payload = rag_messages_payload(context, messages, messages_embedding, data)
 
-        messages_payload = [
-            {"role": "system", "content": f"{context} and use the following context as reference to answer: {context_from_search}"},
-            {"role": "user", "content": f"{messages}"},
-        ]
+        if stream:
+            return stream_chat_completion_for(request, client, async_client, stream_format, model=model, messages=messages_payload, temperature=0.0)
 
         try:
             # Make a request to OpenAI using the Chat Completion endpoint
-            completions = client.chat.completions.create(
+            completions = completion_cache.create(
+                client, data.get('cache', 'use'),
                 model=model,
                 messages=messages_payload,
                 temperature=0.0
@@ -262,9 +439,22 @@ def json_completer(request):
 
             if not json_data:
                 return JsonResponse({"error": "json_data is required"}, status=400)
-
-            response = client.chat.completions.create(
+            if data.get('cache', 'use') not in CACHE_MODES:
+                return JsonResponse({"error": f"cache must be one of {', '.join(CACHE_MODES)}"}, status=400)
+
+            # Most inputs only miss a bracket or have a trailing comma, fix those locally
+            try:
+                obj, repaired = repair_json(json_data)
+                repair_metrics.record('repaired' if repaired else 'valid')
+                return JsonResponse({"result": json.dumps(obj, ensure_ascii=False), "source": "local"}, status=200)
+            except JSONRepairError as e:
+                logging.info(f"json_completer: local repair failed ({e}), asking the model")
+                repair_metrics.record('llm')
+
+            response = completion_cache.create(
+                client, data.get('cache', 'use'),
                 model='gpt-4o',
+                temperature=0.0,
                 response_format={ "type": "json_object" },
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant designed to output well-format JSON. Please just check my json_data and output it without any modification in content, here is your JSON format output:"},
@@ -274,18 +464,33 @@ def json_completer(request):
 
             completed_response = response.choices[0].message.content
 
-            return JsonResponse({"result": completed_response}, status=200)
+            return JsonResponse({"result": completed_response, "source": "llm"}, status=200)
         
         except Exception as e:
             return JsonResponse({"error": f"An error occurred: {str(e)}"}, status=500)
 
     return JsonResponse({"error": "Only POST method is allowed"}, status=405)
 
+@csrf_exempt
+def json_completer_stats(request):
+    if request.method == 'GET':
+        return JsonResponse(repair_metrics.stats(), status=200)
+    return JsonResponse({"error": "Only GET method is allowed"}, status=405)
+
+@csrf_exempt
+def embedding_cache_stats(request):
+    if request.method == 'GET':
+        if embedding_service.cache is None:
+            return JsonResponse({"enabled": False}, status=200)
+        return JsonResponse({"enabled": True, **embedding_service.cache.stats()}, status=200)
+    return JsonResponse({"error": "Only GET method is allowed"}, status=405)
+
 ###############################
 ### openai functions
 ###############################
-def generate_summary(base64Frames, transcript_data, extra_info="",languagestr="en"):
-    response = openai.chat.completions.create(
+def generate_summary(base64Frames, transcript_data, extra_info="",languagestr="en", cache_mode='use'):
+    response = completion_cache.create(
+        client, cache_mode,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": f"""You are generating a video summary. Create a summary of the provided video and its transcript.If frame is silde, please specify it's a slide and extract the text from it. Respond in Markdown. The output language is in {languagestr}"""},
@@ -0,0 +1,40 @@
+# routers.py
+USER_DB_PREFIX = 'userdb_'
+
+# models that live in the per-user databases (userdbs/<id>/<id>.sqlite3)
+USER_MODELS = {'userdocument', 'userchatlog', 'agentpersona', 'useractivitylist'}
+
+def is_user_db(db):
+    return db is not None and db.startswith(USER_DB_PREFIX)
+
+class UserDatabaseRouter:
+    '''
+    Routes the master models to the default database and keeps the per-user
+    databases limited to the user-scoped backend models.
+    Views still pick the user database explicitly with .using(db_name).
+    '''
+
+    def _db_for_model(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+
+        if model._meta.app_label == 'backend' and model._meta.model_name not in USER_MODELS:
+            return 'default'
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_model(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_model(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_user_db(obj1._state.db) or is_user_db(obj2._state.db):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not is_user_db(db) or app_label != 'backend' or model_name is None:
+            return None
+        return model_name in USER_MODELS
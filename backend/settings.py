@@ -125,6 +125,24 @@ DATABASES = {
     }
 }
 
+# Per-user databases (userdb_<id>) are registered at runtime in backend/userdb.py
+DATABASE_ROUTERS = ['backend.routers.UserDatabaseRouter']
+
+# Per-user connection pool: max registered user databases, idle seconds before eviction,
+# and max open user database handles per thread
+USERDB_POOL_MAX_SIZE = int(os.getenv("USERDB_POOL_MAX_SIZE", 64))
+USERDB_POOL_IDLE_TIMEOUT = int(os.getenv("USERDB_POOL_IDLE_TIMEOUT", 300))
+USERDB_POOL_THREAD_MAX_HANDLES = int(os.getenv("USERDB_POOL_THREAD_MAX_HANDLES", 8))
+
+# PRAGMAs applied once to every new SQLite connection, see backend/sqlite_pragmas.py
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),  # ms
+    'journal_mode': 'WAL',
+    'synchronous': os.getenv("SQLITE_SYNCHRONOUS", 'NORMAL'),
+    'cache_size': int(os.getenv("SQLITE_CACHE_SIZE", -20000)),  # negative value is in KiB
+    'mmap_size': int(os.getenv("SQLITE_MMAP_SIZE", 268435456)),  # bytes
+}
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'master')
 MEDIA_URL = '/master/'
 
@@ -254,8 +272,97 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 load_dotenv(dotenv_path='.env.local')
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Shared AsyncOpenAI client, see backend/llm_clients.py
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 500))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 100))
+OPENAI_TIMEOUT = int(os.getenv("OPENAI_TIMEOUT", 600))  # seconds
+OPENAI_MAX_RETRIES = 2
+# concurrent section summaries in generate_description's map_reduce mode
+DESCRIPTION_MAP_WORKERS = int(os.getenv("DESCRIPTION_MAP_WORKERS", 8))
+
+# temperature-0 chat completions, see backend/completion_cache.py
+COMPLETION_CACHE_PATH = os.path.join(BASE_DIR, 'master', 'completion_cache.sqlite3')
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL", 7 * 24 * 3600))  # seconds
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# LanceDB handle cache, see backend/vectordb.py
+LANCEDB_MAX_CACHED_TABLES = int(os.getenv("LANCEDB_MAX_CACHED_TABLES", 512))
+LANCEDB_READ_CONSISTENCY_INTERVAL = int(os.getenv("LANCEDB_READ_CONSISTENCY_INTERVAL", 5))  # seconds
+
+# Vector/scalar index management, see backend/vector_index.py
+LANCEDB_INDEX_MIN_ROWS = int(os.getenv("LANCEDB_INDEX_MIN_ROWS", 10000))  # rows before an IVF_PQ index is built
+LANCEDB_INDEX_REBUILD_GROWTH = 1.0  # retrain once the table doubled since the last build
+LANCEDB_SEARCH_PARAMS = {
+    'simple_rag': {'nprobes': 20, 'refine_factor': 10},
+    'generate_response_rag': {'nprobes': 20, 'refine_factor': 10},
+}
+
+# Batched embeddings, see backend/embeddings.py
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 100000))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 512))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, 'master', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", 4096))  # vectors kept in memory
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", 500000))  # vectors kept on disk
+
+# Background jobs (video ingestion), see backend/jobs.py
+# Set JOB_WORKERS=0 in the web process to run the workers with `manage.py run_job_workers` instead
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(BASE_DIR, 'master', 'jobs.sqlite3'))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", os.cpu_count() or 2))
+
+# Whisper transcription: chunk length (cut at the nearest silence), overlap and parallel uploads
+TRANSCRIBE_CHUNK_MS = 5 * 60 * 1000
+TRANSCRIBE_SILENCE_SEARCH_MS = 20 * 1000
+TRANSCRIBE_OVERLAP_MS = 2000
+TRANSCRIBE_MAX_WORKERS = int(os.getenv("TRANSCRIBE_MAX_WORKERS", 8))
+
+# process_meta_item frame samples: cache size in bytes and dHash distance treated as a duplicate
+FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024
+FRAME_DEDUPE_DISTANCE = 4
+
+# process_meta_item audio: 'transcode' to AUDIO_EXTRACT_BITRATE or 'copy' the stream as is
+AUDIO_EXTRACT_MODE = os.getenv("AUDIO_EXTRACT_MODE", 'transcode')
+AUDIO_EXTRACT_BITRATE = '32k'
+
+# Thumbnails are rendered by a process pool after the upload returns; until then
+# the document lists return the placeholder
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", 'png')  # 'png' or 'webp'
+THUMBNAIL_PLACEHOLDER_URL = os.getenv("THUMBNAIL_PLACEHOLDER_URL", f'{os.getenv("BACKEND_URI", "")}/{STATIC_URL}backend/thumbnail_placeholder.svg')
+
+# list_documents / list_user_documents page size (keyset pagination)
+DOCUMENT_LIST_PAGE_SIZE = int(os.getenv("DOCUMENT_LIST_PAGE_SIZE", 100))
+DOCUMENT_LIST_MAX_PAGE_SIZE = int(os.getenv("DOCUMENT_LIST_MAX_PAGE_SIZE", 1000))
+# seconds between reloads of the display_documents random sample pool
+DOCUMENT_SAMPLE_POOL_REFRESH = int(os.getenv("DOCUMENT_SAMPLE_POOL_REFRESH", 300))
+
+# The master display_documents feed is cached per process by default; point
+# DISPLAY_FEED_CACHE at a file based cache to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'backend-default',
+    },
+    'feed': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'master', 'feed_cache'),
+    },
+}
+DISPLAY_FEED_CACHE = os.getenv("DISPLAY_FEED_CACHE", 'default')
+DISPLAY_FEED_CACHE_TIMEOUT = int(os.getenv("DISPLAY_FEED_CACHE_TIMEOUT", 60))  # seconds
+
 # Maximum size (in bytes) that a request body may be
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600000  # 100 MB (adjust as needed)
 
-# Maximum size (in bytes) that an uploaded file may be
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600000  # 100 MB (adjust as needed)
\ No newline at end of file
+# Uploads larger than this (in bytes) are streamed to FILE_UPLOAD_TEMP_DIR instead of held in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+FILE_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'temp')
+os.makedirs(FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+
+# Both handlers compute the upload's MD5 (uploaded_file.md5) while receiving it
+FILE_UPLOAD_HANDLERS = [
+    'backend.uploads.MD5MemoryFileUploadHandler',
+    'backend.uploads.MD5TemporaryFileUploadHandler',
+]
\ No newline at end of file
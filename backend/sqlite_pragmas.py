@@ -0,0 +1,28 @@
+# sqlite_pragmas.py
+from django.conf import settings
+
+# Applied in this order to every new SQLite connection (master and per-user).
+# busy_timeout goes first so switching the journal mode waits for other writers.
+DEFAULT_SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+}
+
+def get_sqlite_pragmas():
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return pragmas
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    # connection_created fires once per new database connection, not per request
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in get_sqlite_pragmas().items():
+            if value is None:
+                continue
+            cursor.execute(f'PRAGMA {name} = {value};')
@@ -0,0 +1,95 @@
+# streaming.py
+import json
+from django.http import StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+
+STREAM_CONTENT_TYPES = {
+    'sse': 'text/event-stream',
+    'ndjson': 'application/x-ndjson',
+}
+
+def format_event(event, payload, stream_format='sse'):
+    if stream_format == 'ndjson':
+        return json.dumps({'event': event, **payload}, ensure_ascii=False) + '\n'
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class _StreamState:
+    # finish reason and usage seen so far, shared by the sync and async event generators
+    def __init__(self):
+        self.usage = None
+        self.finish_reason = None
+
+    def events(self, chunk, stream_format):
+        if chunk.usage:
+            self.usage = chunk.usage.model_dump()
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+        if choice.delta and choice.delta.content:
+            yield format_event('token', {'content': choice.delta.content}, stream_format)
+
+    def done(self, stream_format):
+        return format_event('done', {'finish_reason': self.finish_reason, 'usage': self.usage}, stream_format)
+
+async def chat_completion_events(async_client, stream_format='sse', **kwargs):
+    '''
+    Yields one "token" event per content delta, then a "done" event with the
+    finish reason and usage totals, or an "error" event if the call fails.
+    '''
+    state = _StreamState()
+    try:
+        stream = await async_client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs
+        )
+        async for chunk in stream:
+            for event in state.events(chunk, stream_format):
+                yield event
+        yield state.done(stream_format)
+    except Exception as e:
+        yield format_event('error', {'error': str(e)}, stream_format)
+
+def chat_completion_events_sync(client, stream_format='sse', **kwargs):
+    # sync twin of chat_completion_events for the WSGI views, driven by the sync client
+    state = _StreamState()
+    try:
+        stream = client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs
+        )
+        with stream:
+            for chunk in stream:
+                yield from state.events(chunk, stream_format)
+        yield state.done(stream_format)
+    except Exception as e:
+        yield format_event('error', {'error': str(e)}, stream_format)
+
+def streaming_response(events, stream_format):
+    response = StreamingHttpResponse(events, content_type=STREAM_CONTENT_TYPES[stream_format])
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # disable proxy buffering
+    return response
+
+def stream_chat_completion(async_client, stream_format='sse', **kwargs):
+    # An async iterator, so the ASGI handler (backend/asgi.py) sends every chunk as it arrives.
+    # Only for ASGI requests: the shared async client must stay on the server's event loop.
+    if stream_format not in STREAM_CONTENT_TYPES:
+        stream_format = 'sse'
+    return streaming_response(chat_completion_events(async_client, stream_format, **kwargs), stream_format)
+
+def stream_chat_completion_sync(client, stream_format='sse', **kwargs):
+    # A plain iterator over the sync client, for the views served by WSGI
+    if stream_format not in STREAM_CONTENT_TYPES:
+        stream_format = 'sse'
+    return streaming_response(chat_completion_events_sync(client, stream_format, **kwargs), stream_format)
+
+def stream_chat_completion_for(request, client, async_client, stream_format='sse', **kwargs):
+    # Sync views are served by both handlers. Under ASGI, Django reads a sync iterator to the
+    # end before sending anything, so ASGI requests stream from the async client instead.
+    if isinstance(request, ASGIRequest):
+        return stream_chat_completion(async_client, stream_format, **kwargs)
+    return stream_chat_completion_sync(client, stream_format, **kwargs)
@@ -0,0 +1,181 @@
+import io
+import os
+import json
+import sys
+import asyncio
+import tempfile
+import unittest
+import subprocess
+import importlib.util
+from types import SimpleNamespace
+
+from .json_repair import repair_json, JSONRepairError
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_INSTALLED = all(importlib.util.find_spec(name) for name in ('django', 'allauth', 'cms', 'lancedb'))
+
+class RepairJSONTests(unittest.TestCase):
+
+    def assertRepaired(self, text, expected):
+        obj, repaired = repair_json(text)
+        self.assertEqual(obj, expected)
+        self.assertTrue(repaired)
+
+    def test_valid_json_is_not_repaired(self):
+        self.assertEqual(repair_json('{"a": [1, 2.5, null]}'), ({'a': [1, 2.5, None]}, False))
+
+    def test_code_fence(self):
+        self.assertEqual(repair_json('```json\n{"a": 1}\n```'), ({'a': 1}, False))
+
+    def test_trailing_and_doubled_commas(self):
+        self.assertRepaired('{"a": 1,, "b": [1, 2,],}', {'a': 1, 'b': [1, 2]})
+
+    def test_missing_commas(self):
+        self.assertRepaired('{"a": 1 "b": "x"\n"c": [1\n2]}', {'a': 1, 'b': 'x', 'c': [1, 2]})
+
+    def test_single_quotes(self):
+        self.assertRepaired("{'a': 'it\\'s', 'b': 'say \"hi\"'}", {'a': "it's", 'b': 'say "hi"'})
+
+    def test_truncated(self):
+        self.assertRepaired('{"a": [1, {"b": "unfinished', {'a': [1, {'b': 'unfinished'}]})
+        self.assertRepaired('{"a": 1, "b"', {'a': 1, 'b': None})
+
+    def test_python_literals(self):
+        self.assertRepaired('{"a": True, "b": None, "c": False}', {'a': True, 'b': None, 'c': False})
+
+    def test_comments(self):
+        self.assertRepaired('{"a": 1, // one\n "b": 2 /* two */}', {'a': 1, 'b': 2})
+
+    def test_unquoted_keys(self):
+        self.assertRepaired('{first name: "John", age: 30}', {'first name': 'John', 'age': 30})
+
+    def test_unquoted_values_run_to_the_member_end(self):
+        self.assertRepaired('{"name": John Smith, "city": New York}', {'name': 'John Smith', 'city': 'New York'})
+        self.assertRepaired('{name: John Smith\n age: 30}', {'name': 'John Smith', 'age': 30})
+        self.assertRepaired('["a b", c d]', ['a b', 'c d'])
+
+    def test_unquoted_value_keeps_urls(self):
+        self.assertRepaired('{"url": https://example.com/a}', {'url': 'https://example.com/a'})
+
+    def test_trailing_content_raises(self):
+        for text in ('{"a": 1} {"b": 2}', '{"a": 1}]', '[1, 2] and some prose'):
+            with self.subTest(text=text), self.assertRaises(JSONRepairError):
+                repair_json(text)
+
+    def test_trailing_whitespace_and_comments_are_fine(self):
+        self.assertRepaired('{"a": 1,}  // done\n', {'a': 1})
+
+    def test_ambiguous_literals_raise(self):
+        for text in ('{"a": tru}', '{"a": nul', '{"a": TRUE}', '[fals]'):
+            with self.subTest(text=text), self.assertRaises(JSONRepairError):
+                repair_json(text)
+
+    def test_ambiguous_numbers_raise(self):
+        for text in ('{"a": 01}', '{"a": 1.2.3}', '[1 2 3]', '{"a": +1}', '{"a": 12 apples}'):
+            with self.subTest(text=text), self.assertRaises(JSONRepairError):
+                repair_json(text)
+
+    def test_unquoted_value_with_json_syntax_raises(self):
+        for text in ('{a: 1 b: 2}', '{"a": b {c: 1}}'):
+            with self.subTest(text=text), self.assertRaises(JSONRepairError):
+                repair_json(text)
+
+    def test_no_json(self):
+        with self.assertRaises(JSONRepairError):
+            repair_json('no json here')
+
+@unittest.skipUnless(importlib.util.find_spec('django'), 'Django is not installed')
+class PersistedUploadTests(unittest.TestCase):
+
+    def test_only_files_in_the_upload_dir_are_removed(self):
+        from .uploads import is_persisted_upload, remove_persisted_upload
+
+        with tempfile.TemporaryDirectory() as tmp:
+            temp_dir = os.path.join(tmp, 'temp')
+            os.makedirs(temp_dir)
+            upload = os.path.join(temp_dir, 'a.mp4')
+            outside = os.path.join(tmp, 'settings.py')
+            for path in (upload, outside):
+                open(path, 'w').close()
+
+            self.assertTrue(is_persisted_upload(upload, temp_dir))
+            for path in (outside, os.path.join(temp_dir, '..', 'settings.py'), temp_dir, None):
+                with self.subTest(path=path):
+                    self.assertFalse(is_persisted_upload(path, temp_dir))
+
+            with self.assertLogs(level='WARNING'):
+                remove_persisted_upload(os.path.join(temp_dir, '..', 'settings.py'), temp_dir)
+            remove_persisted_upload(upload, temp_dir)
+            self.assertFalse(os.path.exists(upload))
+            self.assertTrue(os.path.exists(outside))
+
+def _chunk(content=None, finish_reason=None):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta, finish_reason=finish_reason)])
+
+class _GatedAsyncClient:
+    # yields one token, then holds the upstream stream open until release is set
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.finished = False
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        async def stream():
+            yield _chunk('Hel')
+            await self.release.wait()
+            yield _chunk('lo', finish_reason='stop')
+            self.finished = True
+        return stream()
+
+@unittest.skipUnless(importlib.util.find_spec('django'), 'Django is not installed')
+class ASGIStreamingTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from django.conf import settings
+        if not settings.configured:
+            settings.configure()
+
+    def test_asgi_request_streams_chunks_as_they_arrive(self):
+        from django.core.handlers.asgi import ASGIRequest
+        from .streaming import stream_chat_completion_for
+
+        async_client = _GatedAsyncClient()
+        request = ASGIRequest({'type': 'http', 'method': 'POST', 'path': '/', 'headers': []}, io.BytesIO())
+        response = stream_chat_completion_for(request, None, async_client, 'ndjson', model='m', messages=[])
+
+        async def drive():
+            chunks = response.__aiter__()
+            first = await asyncio.wait_for(chunks.__anext__(), timeout=5)
+            self.assertFalse(async_client.finished)
+            async_client.release.set()
+            return first, [chunk async for chunk in chunks]
+
+        first, rest = asyncio.run(drive())
+        self.assertEqual(json.loads(first), {'event': 'token', 'content': 'Hel'})
+        self.assertEqual([json.loads(chunk)['event'] for chunk in rest], ['token', 'done'])
+        self.assertTrue(async_client.finished)
+
+@unittest.skipUnless(PROJECT_INSTALLED, 'the project requirements are not installed')
+class JobWorkerStartupTests(unittest.TestCase):
+
+    def test_app_ready_starts_job_workers(self):
+        # a fresh process, ready() runs inside django.setup() and must not re-enter it
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DJANGO_SETTINGS_MODULE='backend.settings', JOB_WORKERS='2',
+                       JOB_QUEUE_PATH=os.path.join(tmp, 'jobs.sqlite3'))
+            env.setdefault('OPENAI_API_KEY', 'test')
+            script = (
+                'import django; django.setup()\n'
+                'from backend.jobs import job_queue, _handlers\n'
+                'print(len(job_queue._threads), sorted(_handlers))\n'
+            )
+            result = subprocess.run([sys.executable, '-c', script], cwd=PROJECT_DIR, env=env,
+                                    capture_output=True, text=True, timeout=120)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("2 ['extract_text_from_video', 'process_meta_item']", result.stdout)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# thumbnails.py
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+
+from .utils import render_pdf_thumbnail, render_text_thumbnail, render_video_thumbnail
+
+PENDING = 'pending'
+UNCHANGED = 'unchanged'
+NONE = 'none'
+
+def render_thumbnail(kind, source, image_format='png'):
+    # runs in the worker process, returns the encoded image or None
+    if kind == 'pdf':
+        return render_pdf_thumbnail(source, image_format=image_format)
+    if kind == 'txt':
+        return render_text_thumbnail(source, image_format=image_format)
+    if kind == 'video':
+        return render_video_thumbnail(source, image_format=image_format)
+    return None
+
+def thumbnail_source(document, doc_type, file_type, doc_text):
+    # (kind, source) to render for an uploaded document, or None
+    if doc_type == 'pdf':
+        return 'pdf', document.file.path
+    if doc_type == 'txt':
+        return 'txt', (doc_text or '')[:500]
+    if file_type == 'videos':
+        return 'video', document.doc_uri
+    return None
+
+class ThumbnailService:
+    '''
+    Renders document thumbnails in a process pool so uploads return before the
+    render is done. Finished renders are written back to the document by a
+    single saver thread; until then thumbnail_url() returns the placeholder.
+    '''
+
+    def __init__(self, max_workers=2, placeholder_url='', image_format='png'):
+        self.max_workers = max_workers
+        self.image_format = image_format
+        self.placeholder_url = placeholder_url
+        self._pool = None
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnail-saver')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # fork would copy the parent's threads, locks and open DB connections into the worker
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context(method),
+                )
+            return self._pool
+
+    def is_pending(self, doc_id):
+        return doc_id in self._pending
+
+    def thumbnail_url(self, doc, backend_uri):
+        if doc.thumbnail:
+            return f"{backend_uri}/{doc.thumbnail.url}"
+        if self.is_pending(doc.doc_id):
+            return self.placeholder_url
+        return ""
+
+    def schedule(self, document, doc_type, file_type, doc_text, previous_md5=None, using='default', user_id=None):
+        '''
+        Queues a render for the document and returns PENDING, UNCHANGED when the
+        stored thumbnail was made from the same doc_md5, or NONE for types
+        without a thumbnail.
+        '''
+        if previous_md5 and previous_md5 == document.doc_md5 and document.thumbnail:
+            return UNCHANGED
+
+        source = thumbnail_source(document, doc_type, file_type, doc_text)
+        if source is None:
+            return NONE
+
+        doc_id = document.doc_id
+        with self._lock:
+            self._pending.add(doc_id)
+
+        future = self._get_pool().submit(render_thumbnail, *source, self.image_format)
+        future.add_done_callback(
+            lambda f: self._saver.submit(self._save, type(document), doc_id, f, using, user_id)
+        )
+        return PENDING
+
+    def _save(self, model, doc_id, future, using, user_id):
+        try:
+            data = future.result()
+            if data is None:
+                return
+
+            if user_id is not None:
+                # the user alias may have left the connection pool since the upload
+                from .userdb import user_database_connection
+                using = user_database_connection(user_id)
+
+            document = model.objects.using(using).get(pk=doc_id)
+            if document.thumbnail:
+                document.thumbnail.delete(save=False)
+            document.thumbnail.save(f"{doc_id}_thumbnail.{self.image_format}", ContentFile(data), save=False)
+            model.objects.using(using).filter(pk=doc_id).update(thumbnail=document.thumbnail.name)
+            if using == 'default':
+                # .update() sends no post_save, drop feeds that still show the placeholder
+                from .feed_cache import invalidate_display_feed
+                invalidate_display_feed()
+        except Exception as e:
+            logging.error(f"(ThumbnailService) thumbnail for {doc_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(doc_id)
+            close_old_connections()
+            # the saver thread never sees a request boundary; imported here to
+            # keep the render workers' imports light
+            from .userdb import user_db_pool
+            user_db_pool.close_evicted_connections()
+
+thumbnail_service = ThumbnailService(
+    max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+    placeholder_url=getattr(settings, 'THUMBNAIL_PLACEHOLDER_URL', ''),
+    image_format=getattr(settings, 'THUMBNAIL_FORMAT', 'png'),
+)
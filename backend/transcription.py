@@ -0,0 +1,99 @@
+# transcription.py
+import os
+import tempfile
+import openai
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydub import AudioSegment
+from pydub.silence import detect_silence
+from django.conf import settings
+
+CHUNK_MS = getattr(settings, 'TRANSCRIBE_CHUNK_MS', 5 * 60 * 1000)
+SILENCE_SEARCH_MS = getattr(settings, 'TRANSCRIBE_SILENCE_SEARCH_MS', 20 * 1000)
+OVERLAP_MS = getattr(settings, 'TRANSCRIBE_OVERLAP_MS', 2000)
+MAX_WORKERS = getattr(settings, 'TRANSCRIBE_MAX_WORKERS', 8)
+
+def find_cut_point(audio, target_ms, search_ms=SILENCE_SEARCH_MS):
+    '''
+    Returns the middle of the silence closest to target_ms, looking
+    search_ms either side of it, or target_ms if there is no silence.
+    '''
+    window_start = max(0, target_ms - search_ms)
+    window = audio[window_start:target_ms + search_ms]
+    silences = detect_silence(window, min_silence_len=400, silence_thresh=window.dBFS - 16, seek_step=10)
+    if not silences:
+        return target_ms
+    middles = [window_start + (start + end) // 2 for start, end in silences]
+    return min(middles, key=lambda ms: abs(ms - target_ms))
+
+def plan_chunks(audio, chunk_ms=CHUNK_MS, overlap_ms=OVERLAP_MS):
+    '''
+    Splits the audio at silences near every chunk_ms. Each chunk is padded by
+    overlap_ms on both sides; keep_start/keep_end (seconds) mark the part of
+    the chunk its segments are kept for, offset is where the chunk starts.
+    '''
+    length = len(audio)
+    cuts = [0]
+    while length - cuts[-1] > chunk_ms + chunk_ms // 4:
+        cuts.append(find_cut_point(audio, cuts[-1] + chunk_ms))
+    cuts.append(length)
+
+    chunks = []
+    for i, (start, end) in enumerate(zip(cuts, cuts[1:])):
+        padded_start = max(0, start - overlap_ms)
+        padded_end = min(length, end + overlap_ms)
+        chunks.append({
+            'index': i,
+            'start_ms': padded_start,
+            'end_ms': padded_end,
+            'offset': padded_start / 1000,
+            'keep_start': start / 1000,
+            'keep_end': end / 1000 if end < length else float('inf'),
+        })
+    return chunks
+
+def transcribe_chunk(audio, chunk, temp_dir):
+    fd, temp_audio_file = tempfile.mkstemp(suffix=".mp3", dir=temp_dir)
+    os.close(fd)  # Close the file descriptor
+    try:
+        audio[chunk['start_ms']:chunk['end_ms']].export(temp_audio_file, format="mp3", bitrate="64k")
+        with open(temp_audio_file, "rb") as audio_file:
+            return openai.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                response_format="verbose_json",
+                timestamp_granularities=["segment"]
+            )
+    finally:
+        os.remove(temp_audio_file)
+
+def transcribe_audio(file_path, temp_dir, progress=None, max_workers=MAX_WORKERS):
+    '''
+    Transcribes the chunks concurrently and returns [(chunk, transcript), ...]
+    in audio order, ready for extract_and_concatenate_segments.
+    '''
+    try:
+        # Whisper resamples to 16 kHz mono anyway, converting up front shrinks the PCM buffer and the uploads
+        audio = AudioSegment.from_file(file_path).set_channels(1).set_frame_rate(16000)
+    except Exception as e:
+        print(f"(transcribe_audio) An AudioSegmenterror occurred: {e}")
+        print(f"file_path: {file_path}")
+        return None
+
+    chunks = plan_chunks(audio)
+    results = [None] * len(chunks)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)))
+    try:
+        futures = {executor.submit(transcribe_chunk, audio, chunk, temp_dir): chunk for chunk in chunks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            chunk = futures[future]
+            results[chunk['index']] = (chunk, future.result())
+            if progress: progress(done / len(chunks))
+    except Exception as e:
+        print(f"(transcribe_audio) An error occurred: {e}")
+        return None
+    finally:
+        # don't wait for the remaining API calls after an error or cancellation
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
@@ -0,0 +1,83 @@
+# uploads.py
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# where the video views persist uploads for ffmpeg and the job workers
+UPLOAD_TEMP_DIR = os.path.join(os.getcwd(), 'temp')
+
+class MD5MemoryFileUploadHandler(MemoryFileUploadHandler):
+    # small uploads stay in memory, the MD5 is exposed as uploaded_file.md5
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        self.md5 = hashlib.md5()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.md5.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.md5 = self.md5.hexdigest()
+        return file
+
+class MD5TemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    # everything above FILE_UPLOAD_MAX_MEMORY_SIZE is streamed to FILE_UPLOAD_TEMP_DIR chunk by chunk
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        self.md5 = hashlib.md5()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.md5 = self.md5.hexdigest()
+        return file
+
+def persist_upload(uploaded_file, temp_dir, suffix=''):
+    '''
+    Returns the path of a copy of the upload that outlives the request.
+    Uploads already on disk are hard-linked, so no bytes are copied;
+    the caller removes the file when done.
+    '''
+    os.makedirs(temp_dir, exist_ok=True)
+    path = os.path.join(temp_dir, f'{uuid.uuid4().hex}{suffix}')
+
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        try:
+            os.link(uploaded_file.temporary_file_path(), path)
+            return path
+        except OSError:
+            pass  # different filesystem, fall back to a chunked copy
+
+    uploaded_file.seek(0)
+    with open(path, 'wb') as destination:
+        shutil.copyfileobj(uploaded_file, destination, UPLOAD_CHUNK_SIZE)
+    return path
+
+def is_persisted_upload(path, temp_dir=UPLOAD_TEMP_DIR):
+    # persist_upload writes straight into temp_dir, anything else is not ours to delete
+    if not isinstance(path, str):
+        return False
+    return os.path.dirname(os.path.realpath(path)) == os.path.realpath(temp_dir)
+
+def remove_persisted_upload(path, temp_dir=UPLOAD_TEMP_DIR):
+    if not is_persisted_upload(path, temp_dir):
+        logging.warning(f"(remove_persisted_upload) refusing to remove {path!r}, it is not in {temp_dir}")
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
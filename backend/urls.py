@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
-from . import views, openai_views, agent_views
+from . import views, openai_views, agent_views, async_views
 
 from django.conf import settings
 from django.conf.urls.static import static
@@ -26,6 +26,11 @@ urlpatterns = [
     path('api/upload_user_document/', views.upload_user_document, name='upload_user_document'),
     path('api/list_user_documents/', views.list_user_documents, name='list_user_documents'),
 
+    # background jobs
+    path('api/jobs/submit/', views.submit_job, name='submit_job'),
+    path('api/jobs/<str:job_id>/', views.job_status, name='job_status'),
+    path('api/jobs/<str:job_id>/cancel/', views.cancel_job, name='cancel_job'),
+
     # openai 
     path('api/ask_question_about_image/', openai_views.ask_question_about_image, name='ask_question_about_image'),
     path('api/get_embedding/', openai_views.get_embedding, name='get_embedding'),
@@ -33,6 +38,15 @@ urlpatterns = [
     path('api/generate_response_rag/', openai_views.generate_response_rag, name='generate_response_rag'),
     path('api/generate_response/', openai_views.generate_response, name='generate_response'),
     path('api/json-completer/', openai_views.json_completer, name='json_completer'),
+    path('api/json-completer/stats/', openai_views.json_completer_stats, name='json_completer_stats'),
+    path('api/embeddings/cache-stats/', openai_views.embedding_cache_stats, name='embedding_cache_stats'),
+
+    # async variants, served by the ASGI application
+    path('api/async/ask_question_about_image/', async_views.ask_question_about_image, name='async_ask_question_about_image'),
+    path('api/async/generate_description/', async_views.generate_description, name='async_generate_description'),
+    path('api/async/generate_response/', async_views.generate_response, name='async_generate_response'),
+    path('api/async/generate_response_rag/', async_views.generate_response_rag, name='async_generate_response_rag'),
+    path('api/async/simple_rag/', async_views.simple_rag, name='async_simple_rag'),
 
     #agent
     path('api/simple_rag/', agent_views.simple_rag, name='simple_rag'),
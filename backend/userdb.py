@@ -0,0 +1,208 @@
+# userdb.py
+import os
+import time
+import threading
+from collections import OrderedDict
+from django.core.signals import request_started, request_finished
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.migrations.loader import MigrationLoader
+from django.db.utils import OperationalError
+from django.core.management import call_command
+from django.conf import settings
+
+from .routers import USER_DB_PREFIX
+
+# The backend migration graph only changes on deploy, so it is loaded once per
+# process. Aliases that are known to be at the latest backend migration are
+# kept in _migrated_aliases and skip every check afterwards.
+_registry_lock = threading.Lock()
+_alias_locks = {}
+_migrated_aliases = set()
+_backend_leaf_nodes = None
+
+def user_database_settings(user_id):
+    db_dir = os.path.join(settings.BASE_DIR, 'userdbs', f'{user_id}')
+    db_path = os.path.join(db_dir, f'{user_id}.sqlite3')
+    os.makedirs(db_dir, exist_ok=True)
+
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': db_path,
+        'ATOMIC_REQUESTS': False,
+        'TIME_ZONE': 'Asia/Taipei',
+        'AUTOCOMMIT': True,
+        'CONN_HEALTH_CHECKS': True,
+        'CONN_MAX_AGE': None, # Kept open across requests, the pool below decides when to close it.
+        'OPTIONS': {},
+    }
+
+class UserConnectionPool:
+    '''
+    LRU set of the per-user database aliases registered in connections.databases.
+    At most max_size aliases are kept; aliases idle for more than idle_timeout
+    seconds or pushed out by newer users are evicted and their settings removed.
+    SQLite handles are thread-local, so every thread closes its own: at request
+    boundaries, on its next acquire() after an eviction, and from the job and
+    thumbnail workers after each task. A thread keeps at most max_thread_handles
+    user handles open and closes its least recently used ones beyond that.
+    '''
+
+    def __init__(self, max_size=64, idle_timeout=300, max_thread_handles=8):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_thread_handles = max(1, max_thread_handles)
+        self._entries = OrderedDict()  # alias -> last used (monotonic)
+        self._generation = 0  # bumped on every eviction
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._eviction_hooks = []
+
+    def __contains__(self, db_name):
+        return db_name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add_eviction_hook(self, hook):
+        # hook(db_name) is called after an alias has been evicted
+        self._eviction_hooks.append(hook)
+
+    def acquire(self, user_id):
+        db_name = f'{USER_DB_PREFIX}{user_id}'
+        now = time.monotonic()
+
+        with self._lock:
+            if db_name not in self._entries:
+                connections.databases[db_name] = user_database_settings(user_id)
+            self._entries[db_name] = now
+            self._entries.move_to_end(db_name)
+            evicted = self._collect_evicted(now)
+
+        aliases = self._thread_aliases()
+        aliases[db_name] = None
+        aliases.move_to_end(db_name)
+        for alias in evicted:
+            self._run_eviction_hooks(alias)
+        if getattr(self._local, 'generation', None) != self._generation:
+            self.close_evicted_connections()
+        self._close_thread_overflow(aliases)
+        return db_name
+
+    def evict(self, db_name):
+        with self._lock:
+            if self._entries.pop(db_name, None) is None:
+                return
+            connections.databases.pop(db_name, None)
+            self._generation += 1
+        self._run_eviction_hooks(db_name)
+        self.close_evicted_connections()
+
+    def close_evicted_connections(self, **kwargs):
+        # Connections are thread-local, so every thread closes its own handles.
+        self._local.generation = self._generation
+        aliases = self._thread_aliases()
+        for alias in list(aliases):
+            if alias not in self._entries and self._close_connection(alias):
+                del aliases[alias]
+
+    def _close_thread_overflow(self, aliases):
+        # the aliases stay registered, Django reopens a handle on its next use
+        for alias in list(aliases)[:max(len(aliases) - self.max_thread_handles, 0)]:
+            if self._close_connection(alias):
+                del aliases[alias]
+
+    def _close_connection(self, alias):
+        conn = getattr(connections._connections, alias, None)
+        if conn is not None:
+            if conn.in_atomic_block:
+                return False
+            conn.close()
+            delattr(connections._connections, alias)
+        return True
+
+    def _collect_evicted(self, now):
+        evicted = []
+        while len(self._entries) > 1:
+            alias, last_used = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and now - last_used < self.idle_timeout:
+                break
+            self._entries.popitem(last=False)
+            connections.databases.pop(alias, None)
+            evicted.append(alias)
+        if evicted:
+            self._generation += 1
+        return evicted
+
+    def _run_eviction_hooks(self, db_name):
+        with _registry_lock:
+            _alias_locks.pop(db_name, None)
+        for hook in self._eviction_hooks:
+            try:
+                hook(db_name)
+            except Exception as e:
+                print(f"(UserConnectionPool) eviction hook error: {e}")
+
+    def _thread_aliases(self):
+        # alias -> None, least recently acquired first
+        if not hasattr(self._local, 'aliases'):
+            self._local.aliases = OrderedDict()
+        return self._local.aliases
+
+user_db_pool = UserConnectionPool(
+    max_size=getattr(settings, 'USERDB_POOL_MAX_SIZE', 64),
+    idle_timeout=getattr(settings, 'USERDB_POOL_IDLE_TIMEOUT', 300),
+    max_thread_handles=getattr(settings, 'USERDB_POOL_THREAD_MAX_HANDLES', 8),
+)
+request_started.connect(user_db_pool.close_evicted_connections)
+request_finished.connect(user_db_pool.close_evicted_connections)
+
+def user_database_connection(user_id):
+    return user_db_pool.acquire(user_id)
+
+def get_backend_leaf_nodes():
+    global _backend_leaf_nodes
+    if _backend_leaf_nodes is None:
+        with _registry_lock:
+            if _backend_leaf_nodes is None:
+                # no connection: read the migration files from disk only
+                loader = MigrationLoader(None, ignore_no_migrations=True)
+                _backend_leaf_nodes = set(loader.graph.leaf_nodes('backend'))
+    return _backend_leaf_nodes
+
+def forget_user_db(db_name):
+    # call when the database file is removed or replaced
+    _migrated_aliases.discard(db_name)
+
+def _alias_lock(db_name):
+    with _registry_lock:
+        return _alias_locks.setdefault(db_name, threading.Lock())
+
+def apply_migrations_to_user_db(connection, db_name):
+    if db_name in _migrated_aliases:
+        return
+
+    with _alias_lock(db_name):
+        if db_name in _migrated_aliases:
+            return
+
+        # create table if not created
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='django_migrations';")
+                table_exists = cursor.fetchone()
+
+            if not table_exists:
+                call_command('migrate', 'backend', '--database', db_name, '--noinput')
+
+        except OperationalError as e:
+            print(f"OperationalError: {e}")
+            return
+
+        applied_migrations = set(MigrationRecorder(connection).applied_migrations())
+        unapplied_backend_migrations = get_backend_leaf_nodes() - applied_migrations
+
+        if unapplied_backend_migrations:
+            call_command('migrate', 'backend', '--database', db_name, '--noinput')
+
+        _migrated_aliases.add(db_name)
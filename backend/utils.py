@@ -4,10 +4,13 @@ import json
 import langid
 import tiktoken
 import io
+from functools import lru_cache
+import os
 import fitz
 import cv2
 from PIL import Image, ImageDraw, ImageFont
-from django.core.files.uploadedfile import InMemoryUploadedFile
+
+THUMBNAIL_WIDTH = 300
 
 def json_to_dataframe(json_data, doc_id, user_id, file_type):
     json_data = json.loads(json_data)
@@ -40,11 +43,36 @@ def lang_detect(text):
         mylang = languagetype[0]
     return mylang
 
-def calculate_tokens(text, model_name):
-    enc = tiktoken.encoding_for_model(model_name)
-    return len(enc.encode(text))
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    # resolved once per model, unknown model names fall back to cl100k_base
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
 
-def generate_text_thumbnail(text, doc_id):
+def calculate_tokens(text, model_name):
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
+
+def calculate_tokens_batch(texts, model_name, num_threads=8):
+    # token counts for many strings, encoded in parallel by tiktoken
+    encoded = get_encoding(model_name).encode_batch(list(texts), num_threads=num_threads, disallowed_special=())
+    return [len(tokens) for tokens in encoded]
+
+def trim_to_tokens(text, max_tokens, model_name):
+    '''
+    Encodes text once and cuts it at a token boundary.
+    Returns (text, token count) with token count <= max_tokens.
+    '''
+    enc = get_encoding(model_name)
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    max_tokens = max(int(max_tokens), 0)
+    # a cut inside a multi-byte character decodes to U+FFFD, drop it
+    return enc.decode(tokens[:max_tokens]).rstrip('\ufffd'), max_tokens
+
+def render_text_thumbnail(text, image_format='png'):
     # Create an image for the text thumbnail
     img = Image.new('RGB', (300, 150), color=(255, 255, 255))
     draw = ImageDraw.Draw(img)
@@ -53,61 +81,60 @@ def generate_text_thumbnail(text, doc_id):
     # Draw the text on the image
     draw.text((10, 10), text, fill=(0, 0, 0), font=font)
 
-    # Save the image to a BytesIO object
     thumbnail_io = io.BytesIO()
-    img.save(thumbnail_io, format='PNG')
-    thumbnail_io.seek(0)
-
-    # Create an InMemoryUploadedFile
-    thumbnail = InMemoryUploadedFile(
-        thumbnail_io, None, f"{doc_id}_thumbnail.png", 'image/png', thumbnail_io.getbuffer().nbytes, None
-    )
-
-    return thumbnail
-
-def generate_pdf_thumbnail(file, doc_id):
-    # Logic to generate a thumbnail for a PDF file
-    pdf_document = fitz.open(stream=file.read(), filetype='pdf')
-    page = pdf_document.load_page(0)  # Get the first page
-    pix = page.get_pixmap()
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-    # Save the image to a BytesIO object
+    img.save(thumbnail_io, format=image_format.upper())
+    return thumbnail_io.getvalue()
+
+def open_pdf(source):
+    '''
+    Opens a PDF without reading it into memory when it is on disk: MuPDF reads
+    a file path lazily, so only the pages that are rendered are loaded. Only
+    in-memory uploads (at most FILE_UPLOAD_MAX_MEMORY_SIZE) are opened from bytes.
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if hasattr(source, 'temporary_file_path'):
+        return fitz.open(source.temporary_file_path())
+    try:
+        return fitz.open(source.path)  # stored FieldFile
+    except (AttributeError, NotImplementedError, ValueError):
+        pass
+    source.seek(0)
+    return fitz.open(stream=source.read(), filetype='pdf')
+
+def encode_pixmap(pix, image_format='png'):
+    if image_format == 'png':
+        return pix.tobytes('png')
+    # PIL wraps the pixmap's sample buffer instead of copying it
+    samples = getattr(pix, 'samples_mv', None) or pix.samples
+    img = Image.frombuffer('RGB', (pix.width, pix.height), samples, 'raw', 'RGB', pix.stride, 1)
     thumbnail_io = io.BytesIO()
-    img.save(thumbnail_io, format='PNG')
-    thumbnail_io.seek(0)
-
-    # Create an InMemoryUploadedFile
-    thumbnail = InMemoryUploadedFile(
-        thumbnail_io, None, f"{doc_id}_thumbnail.png", 'image/png', thumbnail_io.getbuffer().nbytes, None
-    )
-
-    return thumbnail
-
-def generate_video_thumbnail(file_path, doc_id):
+    img.save(thumbnail_io, format=image_format.upper(), quality=80)
+    return thumbnail_io.getvalue()
+
+def render_pdf_thumbnail(source, target_width=THUMBNAIL_WIDTH, image_format='png'):
+    # Render page 0 scaled to target_width instead of the default 72 dpi full page
+    with open_pdf(source) as pdf_document:
+        page = pdf_document.load_page(0)  # Get the first page
+        zoom = target_width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+        return encode_pixmap(pix, image_format)
+
+def render_video_thumbnail(file_path, target_width=THUMBNAIL_WIDTH, image_format='png'):
     # Create a VideoCapture object
     video = cv2.VideoCapture(file_path)
 
     # Read the first frame
     success, image = video.read()
+    video.release()
 
     # Check if frame is read correctly
     if not success:
         return None
 
-    # Convert the frame to RGB
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-    # Convert the frame to a PIL image
-    pil_image = Image.fromarray(image)
-
-    # Save the thumbnail as a BytesIO object
-    thumbnail_io = io.BytesIO()
-    pil_image.save(thumbnail_io, format='PNG')
-
-    # Create an InMemoryUploadedFile
-    thumbnail = InMemoryUploadedFile(
-        thumbnail_io, None, f"{doc_id}_thumbnail.png", 'image/png', thumbnail_io.getbuffer().nbytes, None
-    )
+    height, width = image.shape[:2]
+    if width > target_width:
+        image = cv2.resize(image, (target_width, int(height * target_width / width)), interpolation=cv2.INTER_AREA)
 
-    return thumbnail
\ No newline at end of file
+    _, buffer = cv2.imencode(f'.{image_format}', image)
+    return buffer.tobytes()
@@ -0,0 +1,175 @@
+# vector_index.py
+import math
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+from .vectordb import lance_cache
+
+# scalar (prefilter) indexes per table: column -> lance index type
+SCALAR_INDEXES = {
+    'Research_paper_table': {'doc_id': 'BTREE', 'user_id': 'BITMAP', 'file_type': 'BITMAP'},
+    'KnowledgeObject_table': {'doc_id': 'BTREE', 'user_id': 'BITMAP'},
+}
+
+# full-text (BM25) index for the lexical / hybrid simple_rag modes
+FTS_COLUMNS = {
+    'Research_paper_table': 'content',
+    'KnowledgeObject_table': 'content',
+}
+
+VECTOR_COLUMN = 'vector'
+VECTOR_METRIC = 'cosine'
+
+DEFAULT_SEARCH_PARAMS = {'nprobes': 20, 'refine_factor': 10}
+
+class VectorIndexManager:
+    '''
+    Keeps the LanceDB tables indexed as they grow.
+    After every write the table is queued on a single background worker which
+      - creates the scalar indexes used by where() prefilters,
+      - creates the full-text index used by lexical search,
+      - builds an IVF-PQ index once the table has min_rows rows,
+      - afterwards folds new rows into the existing indexes with
+        optimize_indices(), and retrains the vector index from scratch once
+        the table grew by rebuild_growth.
+    Only missing indexes are created; existing ones are never replaced.
+    Tables known to have their full-text index are remembered until the next
+    write or until their handles are evicted, so searches skip list_indices().
+    '''
+
+    def __init__(self, min_rows=10000, rebuild_growth=1.0):
+        self.min_rows = min_rows
+        self.rebuild_growth = rebuild_growth
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vector-index')
+        self._pending = set()
+        self._fts_ready = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, uri, table_name):
+        key = (uri, table_name)
+        with self._lock:
+            # the table changed, has_fts_index() looks at it again
+            self._fts_ready.discard(key)
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._run, uri, table_name)
+
+    def _run(self, uri, table_name):
+        with self._lock:
+            self._pending.discard((uri, table_name))
+        try:
+            self.ensure_indexes(uri, table_name)
+        except Exception as e:
+            logging.error(f"(VectorIndexManager) indexing {uri}/{table_name} failed: {e}")
+
+    def _indices(self, tbl):
+        # the sync LanceTable has no index API; the lance dataset behind it does
+        ds = tbl.to_lance()
+        return ds, {field: index['name'] for index in ds.list_indices() for field in index['fields']}
+
+    def has_fts_index(self, tbl, uri, table_name):
+        key = (uri, table_name)
+        with self._lock:
+            if key in self._fts_ready:
+                return True
+        _, indices = self._indices(tbl)
+        ready = FTS_COLUMNS.get(table_name) in indices
+        if ready:
+            with self._lock:
+                self._fts_ready.add(key)
+        return ready
+
+    def forget(self, uri, table_name=None):
+        # lance_cache eviction hook: the table may be rewritten or dropped while nobody holds it
+        with self._lock:
+            self._fts_ready = {
+                key for key in self._fts_ready
+                if key[0] != uri or (table_name is not None and key[1] != table_name)
+            }
+
+    def ensure_indexes(self, uri, table_name):
+        tbl = lance_cache.table(uri, table_name)
+        if not tbl.count_rows():
+            # lance can't build (or later load) an index over an empty table
+            return
+        ds, indices = self._indices(tbl)
+
+        created = False
+        for column, index_type in SCALAR_INDEXES.get(table_name, {}).items():
+            if column not in indices:
+                tbl.create_scalar_index(column, index_type=index_type)
+                created = True
+
+        fts_column = FTS_COLUMNS.get(table_name)
+        if fts_column and fts_column not in indices:
+            # native lance inverted index, kept up to date by optimize_indices() like the vector index
+            tbl.create_fts_index(fts_column, use_tantivy=False)
+            created = True
+
+        if created:
+            ds, indices = self._indices(tbl)
+        if fts_column and fts_column in indices:
+            with self._lock:
+                self._fts_ready.add((uri, table_name))
+
+        num_rows = tbl.count_rows()
+        if VECTOR_COLUMN not in indices and num_rows >= self.min_rows:
+            self._build_vector_index(tbl, num_rows)
+            ds, indices = self._indices(tbl)
+        elif VECTOR_COLUMN in indices:
+            num_indexed = ds.stats.index_stats(indices[VECTOR_COLUMN]).get('num_indexed_rows', 0)
+            if num_indexed and num_rows >= num_indexed * (1 + self.rebuild_growth):
+                # partitions were trained on a much smaller table
+                self._build_vector_index(tbl, num_rows)
+                ds, indices = self._indices(tbl)
+
+        if any(self._unindexed_rows(ds, name) for name in indices.values()):
+            # incremental: new rows are added to the existing indexes, nothing is retrained
+            ds.optimize.compact_files()
+            ds.optimize.optimize_indices()
+
+    def _unindexed_rows(self, ds, index_name):
+        return ds.stats.index_stats(index_name).get('num_unindexed_rows', 0)
+
+    def _build_vector_index(self, tbl, num_rows):
+        dim = tbl.schema.field(VECTOR_COLUMN).type.list_size
+        tbl.create_index(
+            metric=VECTOR_METRIC,
+            vector_column_name=VECTOR_COLUMN,
+            index_type='IVF_PQ',
+            num_partitions=max(1, int(math.sqrt(num_rows))),
+            num_sub_vectors=dim // 16,
+            replace=True,
+        )
+        logging.info(f"(VectorIndexManager) built IVF_PQ index on {tbl.name} with {num_rows} rows")
+
+index_manager = VectorIndexManager(
+    min_rows=getattr(settings, 'LANCEDB_INDEX_MIN_ROWS', 10000),
+    rebuild_growth=getattr(settings, 'LANCEDB_INDEX_REBUILD_GROWTH', 1.0),
+)
+lance_cache.add_eviction_hook(index_manager.forget)
+
+def get_search_params(endpoint, data=None):
+    '''
+    nprobes/refine_factor for an endpoint: defaults, then settings.LANCEDB_SEARCH_PARAMS,
+    then any values passed in the request body.
+    '''
+    params = dict(DEFAULT_SEARCH_PARAMS)
+    params.update(getattr(settings, 'LANCEDB_SEARCH_PARAMS', {}).get(endpoint, {}))
+    if data:
+        for name in DEFAULT_SEARCH_PARAMS:
+            if data.get(name) is not None:
+                params[name] = int(data[name])
+    return params
+
+def apply_search_params(query, endpoint, data=None):
+    # ignored by lance when the table has no vector index yet
+    params = get_search_params(endpoint, data)
+    if params.get('nprobes'):
+        query = query.nprobes(params['nprobes'])
+    if params.get('refine_factor'):
+        query = query.refine_factor(params['refine_factor'])
+    return query
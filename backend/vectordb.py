@@ -0,0 +1,104 @@
+# vectordb.py
+import threading
+from datetime import timedelta
+from collections import OrderedDict
+import lancedb
+from django.conf import settings
+
+from .routers import USER_DB_PREFIX
+from .userdb import user_db_pool
+
+LANCEDB_URI = 'master/lancedb/'
+
+def user_lancedb_uri(user_id):
+    return f'userdbs/{user_id}/lancedb'
+
+class LanceHandleCache:
+    '''
+    Process-wide cache of LanceDB connections and table handles keyed by URI
+    and table name, so requests skip lancedb.connect() and the manifest reads
+    of open_table()/create_table(). Connections are opened with
+    read_consistency_interval, which makes cached handles pick up new table
+    versions written by other workers. At most max_tables handles are kept.
+    '''
+
+    def __init__(self, max_tables=512, read_consistency_interval=5):
+        self.max_tables = max_tables
+        if read_consistency_interval is None:
+            self.read_consistency_interval = None
+        else:
+            self.read_consistency_interval = timedelta(seconds=read_consistency_interval)
+        self._connections = {}
+        self._tables = OrderedDict()  # (uri, table_name) -> table
+        self._lock = threading.RLock()
+        self._eviction_hooks = []
+
+    def add_eviction_hook(self, hook):
+        # hook(uri, table_name) is called after evict(); table_name None means every table of uri
+        self._eviction_hooks.append(hook)
+
+    def connect(self, uri):
+        with self._lock:
+            db = self._connections.get(uri)
+            if db is None:
+                db = lancedb.connect(uri, read_consistency_interval=self.read_consistency_interval)
+                self._connections[uri] = db
+            return db
+
+    def table(self, uri, table_name, schema=None):
+        '''
+        Returns the cached table handle. With a schema the table is created
+        if missing, otherwise it must already exist.
+        '''
+        key = (uri, table_name)
+        with self._lock:
+            tbl = self._tables.get(key)
+            if tbl is not None:
+                self._tables.move_to_end(key)
+                return tbl
+
+        # open outside the lock so a slow manifest read doesn't block other tables
+        db = self.connect(uri)
+        if schema is not None:
+            tbl = db.create_table(table_name, schema=schema, exist_ok=True)
+        else:
+            tbl = db.open_table(table_name)
+
+        with self._lock:
+            tbl = self._tables.setdefault(key, tbl)
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.max_tables:
+                (old_uri, _), _ = self._tables.popitem(last=False)
+                if not any(k[0] == old_uri for k in self._tables):
+                    self._connections.pop(old_uri, None)
+            return tbl
+
+    def evict(self, uri, table_name=None):
+        with self._lock:
+            for key in [k for k in self._tables if k[0] == uri and (table_name is None or k[1] == table_name)]:
+                del self._tables[key]
+            if table_name is None:
+                self._connections.pop(uri, None)
+        for hook in self._eviction_hooks:
+            try:
+                hook(uri, table_name)
+            except Exception as e:
+                print(f"(LanceHandleCache) eviction hook error: {e}")
+
+lance_cache = LanceHandleCache(
+    max_tables=getattr(settings, 'LANCEDB_MAX_CACHED_TABLES', 512),
+    read_consistency_interval=getattr(settings, 'LANCEDB_READ_CONSISTENCY_INTERVAL', 5),
+)
+
+def get_master_table(table_name, schema=None):
+    return lance_cache.table(LANCEDB_URI, table_name, schema)
+
+def get_user_table(user_id, table_name, schema=None):
+    return lance_cache.table(user_lancedb_uri(user_id), table_name, schema)
+
+def _evict_user_handles(db_name):
+    # cold users leave the connection pool and the LanceDB cache together
+    if db_name.startswith(USER_DB_PREFIX):
+        lance_cache.evict(user_lancedb_uri(db_name[len(USER_DB_PREFIX):]))
+
+user_db_pool.add_eviction_hook(_evict_user_handles)
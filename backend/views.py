@@ -1,43 +1,34 @@
 # views.py
 import os
 import json
-import requests
 import django
 from datetime import datetime, timedelta
 import pandas as pd
 from dotenv import load_dotenv
-from django.db import connections, transaction, migrations
-from django.db.migrations.recorder import MigrationRecorder
-from django.db.migrations.loader import MigrationLoader
-from django.db.utils import OperationalError
-from django.core.management import call_command
+from django.db import connections, transaction
 from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 django.setup()
 
 from .models import User, Document, UserDocument
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Q
 from django.utils import timezone
-from .utils import generate_pdf_thumbnail, generate_text_thumbnail, generate_video_thumbnail
-from .openai_views import generate_summary
-
-import base64
-import cv2
-from moviepy.editor import VideoFileClip
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-import tempfile
-import openai
-from pydub import AudioSegment
-from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_audio
+from .thumbnails import thumbnail_service
+from .document_sampling import document_sample_pool
+from .feed_cache import get_display_feed
+from .document_listing import InvalidListingParams, file_type_label, resolve_fields, to_response_row, list_page
+from .uploads import UPLOAD_TEMP_DIR, persist_upload
+from .userdb import user_database_connection, apply_migrations_to_user_db
+from .jobs import job_queue
+from .job_handlers import summarize_meta_item, transcribe_video
+from .vectordb import LANCEDB_URI, lance_cache, user_lancedb_uri, get_master_table, get_user_table
 
 load_dotenv(dotenv_path='.env.local', override=True)
 BACKEND_URI = os.getenv("BACKEND_URI")
-LANCEDB_URI = 'master/lancedb/'
 BASE_DIR = settings.BASE_DIR
 
 ###################
@@ -135,6 +126,7 @@ def upload_document(request):
         display_date = request.POST.get('display_date')
         expire_date = request.POST.get('expire_date')
         file = request.FILES['file']
+        doc_md5 = doc_md5 or getattr(file, 'md5', None)  # hashed while the upload was received
 
         user = get_object_or_404(User, line_user_id=user_id)
 
@@ -154,6 +146,7 @@ def upload_document(request):
             'file': file,
         })
 
+        previous_md5 = None if created else document.doc_md5
         if not created:
             document.doc_title = doc_title
             document.doc_desc = doc_desc
@@ -169,110 +162,69 @@ def upload_document(request):
             document.file.save(file.name, file)
             document.save()
 
-        file.seek(0)
-        # Generate and save the thumbnail
-        if doc_type == 'pdf':
-            # Generate thumbnail for PDF
-            thumbnail = generate_pdf_thumbnail(file, doc_id)
-            document.thumbnail.save(thumbnail.name, thumbnail)
-            document.save()
-        elif doc_type == 'txt':
-            # Generate thumbnail for text file
-            try:
-                text_preview = doc_text[:500] 
-            except:
-                text_preview = doc_text[:]
-            thumbnail = generate_text_thumbnail(text_preview, doc_id)
-            document.thumbnail.save(thumbnail.name, thumbnail)
-            document.save()
+        # The thumbnail is rendered in the background, display_documents shows the
+        # placeholder until it is saved.
+        thumbnail_status = thumbnail_service.schedule(document, doc_type, file_type, doc_text, previous_md5=previous_md5)
 
-        elif file_type == 'videos':
-            thumbnail = generate_video_thumbnail(doc_uri, doc_id)
-            if thumbnail:
-                document.thumbnail.save(thumbnail.name, thumbnail)
-                document.save()
-
-        return JsonResponse({'status': 'success', 'doc_id': document.doc_id}, status=200)
+        return JsonResponse({
+            'status': 'success',
+            'doc_id': document.doc_id,
+            'thumbnail_status': thumbnail_status,
+            'thumbnail': thumbnail_service.thumbnail_url(document, BACKEND_URI),
+        }, status=200)
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 @csrf_exempt
 def list_documents(request):
-    def fetch_documents(file_type=None, user_id=None, doc_id=None):
+    def fetch_documents(file_type=None, user_id=None, doc_id=None, fields=None, include_text=False, limit=None, cursor=None):
         '''
-        This function returns all the instance if no parameters are specified.
+        This function returns all the instance if no parameters are specified, one page at a time with limit or cursor.
         If file_type is specified, then it will filter the file_type.
         If user_id is specified, then it will filter the user_id.
         If doc_id is specified, then it will filter the doc_id.
+        Only `fields` are selected; doc_text and doc_meta need include_text in listings.
+        Returns (doc_list, next_cursor).
         '''
 
         # replace the name
-        if file_type == 'documents': fileType = 'Document'
-        elif file_type == 'videos': fileType = 'Video'
-        else: fileType = 'Instance'
+        fileType = file_type_label(file_type)
 
         if doc_id:
-            document = get_object_or_404(Document, doc_id=doc_id)
-            if file_type and document.file_type != file_type:
-                return []
-
-            doc_list = [{
-                f"{fileType} ID": document.doc_id,
-                f"{fileType} Title": document.doc_title, 
-                f"{fileType} URI": document.doc_uri,
-                f"{fileType} Type": document.doc_type,
-                f"{fileType} Description": document.doc_desc,
-                f"{fileType} Text": document.doc_text,
-                "File Type": document.file_type,
-                "Create Date": document.doc_createdate,
-                "Revise Date": document.doc_revisedate,
-                "Display Date": document.display_date,
-                "Expire Date": document.expire_date,
-                "Share Flag": document.share_flag,
-                "Audit Flag": document.audit_flag,
-                f"{fileType} Meta": document.doc_meta,
-                f"{fileType} Location": document.doc_loc,
-                f"{fileType} MD5": document.doc_md5
-            }]
+            fields = resolve_fields(fields, include_text=True)
+            document = Document.objects.filter(doc_id=doc_id).values(*fields, 'file_type').first()
+            if document is None:
+                raise Http404("No Document matches the given query.")
+            if file_type and document['file_type'] != file_type:
+                return [], None
+            return [to_response_row(document, fields, fileType)], None
+
+        if user_id:
+            user = get_object_or_404(User, line_user_id=user_id)
+            documents = Document.objects.filter(user=user)
         else:
-            if user_id:
-                user = get_object_or_404(User, line_user_id=user_id)
-                documents = Document.objects.filter(user=user)
-            else:
-                documents = Document.objects.all()
+            documents = Document.objects.all()
 
-            if file_type:
-                documents = documents.filter(file_type=file_type)
+        if file_type:
+            documents = documents.filter(file_type=file_type)
 
-            doc_list = []
-            for doc in documents:
-                doc_list.append({
-                    f"{fileType} ID": doc.doc_id,
-                    f"{fileType} Title": doc.doc_title,
-                    f"{fileType} URI": doc.doc_uri,
-                    f"{fileType} Type": doc.doc_type,
-                    f"{fileType} Description": doc.doc_desc,
-                    f"{fileType} Text": doc.doc_text,
-                    "File Type": doc.file_type,
-                    "Create Date": doc.doc_createdate,
-                    "Revise Date": doc.doc_revisedate,
-                    "Display Date": doc.display_date,
-                    "Expire Date": doc.expire_date,
-                    "Share Flag": doc.share_flag,
-                    "Audit Flag": doc.audit_flag,
-                    f"{fileType} Meta": doc.doc_meta,
-                    f"{fileType} Location": doc.doc_loc,
-                    f"{fileType} MD5": doc.doc_md5
-                })
-        
-        return doc_list
+        return list_page(documents, fileType, resolve_fields(fields, include_text), limit, cursor)
 
     if request.method == 'POST':
         data = json.loads(request.body)
         user_id = data.get('user_id')
         doc_id = data.get('doc_id')
         file_type = data.get('file_type')
-        documents = fetch_documents(file_type, user_id, doc_id)
-        return JsonResponse({'status': 'success', 'documents': documents}, status=200)
+        try:
+            documents, next_cursor = fetch_documents(
+                file_type, user_id, doc_id,
+                fields=data.get('fields'),
+                include_text=data.get('include_text', False),
+                limit=data.get('limit'),
+                cursor=data.get('cursor'),
+            )
+        except InvalidListingParams as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        return JsonResponse({'status': 'success', 'documents': documents, 'next_cursor': next_cursor}, status=200)
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
@@ -293,17 +245,11 @@ def update_document(request):
             db_name = user_database_connection(user_id)
             connection = connections[db_name]
 
-            with connection.cursor() as cursor:
-                cursor.execute('PRAGMA foreign_keys = OFF;')
+            apply_migrations_to_user_db(connection, db_name)
 
             with transaction.atomic(using=db_name):
-                apply_migrations_to_user_db(connection, db_name)
-
                 document = get_object_or_404(UserDocument.objects.using(db_name), doc_id=doc_id)
 
-            with connection.cursor() as cursor:
-                cursor.execute('PRAGMA foreign_keys = ON;')
-                
         else:
             document = get_object_or_404(Document, doc_id=doc_id)
 
@@ -334,8 +280,7 @@ def delete_document(request):
 
             document.delete()
 
-            vdb = lancedb.connect(f'userdbs/{user_id}/lancedb')
-            tbl_research = vdb.open_table("Research_paper_table")
+            tbl_research = get_user_table(user_id, "Research_paper_table")
             if tbl_research:
                 tbl_research.delete(f"""doc_id = '{doc_id}'""")
 
@@ -350,8 +295,7 @@ def delete_document(request):
             if user.user_level >= 200 or document.user == user:
                 document.delete()
 
-                vdb = lancedb.connect(LANCEDB_URI)
-                tbl_research = vdb.open_table("Research_paper_table")
+                tbl_research = get_master_table("Research_paper_table")
                 if tbl_research:
                     tbl_research.delete(f"""doc_id = '{doc_id}'""")
 
@@ -369,8 +313,31 @@ def display_documents(request):
         user_doc = data.get('user_doc', False)
         user_id = data.get('user_id')
 
-        # Get the current date and time
-        current_datetime = datetime.now()
+        def build_news_items(db_name, model, current_datetime):
+            documents_query = model.objects.using(db_name).only('doc_id', 'doc_title', 'doc_desc', 'thumbnail')
+
+            if amount is not None:
+                # random doc ids come from the in-memory pool, the rows in one query by primary key
+                sample_ids = document_sample_pool.sample_ids(model, db_name, int(amount), current_datetime)
+                documents_by_id = {doc.doc_id: doc for doc in documents_query.filter(doc_id__in=sample_ids)}
+                documents = [documents_by_id[doc_id] for doc_id in sample_ids if doc_id in documents_by_id]
+            else:
+                documents = documents_query.filter(
+                    (Q(display_date__isnull=True) | Q(display_date__lte=current_datetime)),
+                    (Q(expire_date__isnull=True) | Q(expire_date__gte=current_datetime))
+                ).order_by('doc_createdate')
+
+            news_items = {}
+            for doc in documents:
+                news_item = {
+                    # "Document ID": doc.doc_id,
+                    "Title": doc.doc_title,
+                    # "Description": doc.doc_desc.split('\n', 1)[0],  # Split by new line and get the first part
+                    "Description": doc.doc_desc,
+                    "Thumbnail": thumbnail_service.thumbnail_url(doc, BACKEND_URI)
+                }
+                news_items[doc.doc_id] = news_item
+            return news_items
 
         try:
             if user_doc:
@@ -380,51 +347,13 @@ def display_documents(request):
                 db_name = user_database_connection(user_id)
 
                 connection = connections[db_name]
-                with connection.cursor() as cursor:
-                    cursor.execute('PRAGMA foreign_keys = OFF;')
-
-                with transaction.atomic(using=db_name):
-                    apply_migrations_to_user_db(connection, db_name)
-                    # with connection.schema_editor() as schema_editor:
-                    #     if not schema_editor.connection.introspection.table_names():
-                    #         schema_editor.create_model(UserDocument)
-                    #     else:
-                    #         # apply_migrations_to_user_db(connection, db_name)
-                    #         pass
-
-                    documents_query = UserDocument.objects.using(db_name).filter(
-                        (Q(display_date__isnull=True) | Q(display_date__lte=current_datetime)),
-                        (Q(expire_date__isnull=True) | Q(expire_date__gte=current_datetime))
-                    )
-
-                with connection.cursor() as cursor:
-                    cursor.execute('PRAGMA foreign_keys = ON;')
-
+                apply_migrations_to_user_db(connection, db_name)
+                news_items = build_news_items(db_name, UserDocument, timezone.now())
             else:
-                documents_query = Document.objects.filter(
-                    (Q(display_date__isnull=True) | Q(display_date__lte=current_datetime)),
-                    (Q(expire_date__isnull=True) | Q(expire_date__gte=current_datetime))
-                )
+                # the master feed is the same for every visitor, see feed_cache.py
+                news_items = get_display_feed(amount, lambda now: build_news_items('default', Document, now))
 
-            if amount is not None:
-                documents = documents_query.order_by('?')[:amount]
-            else:
-                documents = documents_query.order_by('doc_createdate')
-
-            if documents.exists():
-                news_items = {}
-                for doc in documents:
-                    news_item = {
-                        # "Document ID": doc.doc_id,
-                        "Title": doc.doc_title,
-                        # "Description": doc.doc_desc.split('\n', 1)[0],  # Split by new line and get the first part
-                        "Description": doc.doc_desc,
-                        "Thumbnail": f"{BACKEND_URI}/{doc.thumbnail.url}" if doc.thumbnail else ""
-                    }
-                    news_items[doc.doc_id] = news_item
-                return JsonResponse({'status': 'success', 'news_items': news_items}, status=200)
-            else:
-                return JsonResponse({'status': 'success', 'news_items': {}}, status=200)
+            return JsonResponse({'status': 'success', 'news_items': news_items}, status=200)
 
         except Exception as e:
             print(f"Display document error: {e}")
@@ -434,61 +363,6 @@ def display_documents(request):
 
 ########################
 # user documents
-def user_database_connection(user_id):
-    db_name = f'userdb_{user_id}'
-    db_dir = os.path.join(settings.BASE_DIR, 'userdbs', f'{user_id}')
-    db_path = os.path.join(db_dir, f'{user_id}.sqlite3')
-    os.makedirs(db_dir, exist_ok=True)
-
-    connections.databases[db_name] = {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': db_path,
-        'ATOMIC_REQUESTS': False,
-        'TIME_ZONE': 'Asia/Taipei',
-        'AUTOCOMMIT': True,
-        'CONN_HEALTH_CHECKS': True,
-        'CONN_MAX_AGE': 0, # Use 0 to close database connections at the end of each request, None for unlimited persistent database connections.
-        'OPTIONS': {},
-    }
-    return db_name
-
-def apply_migrations_to_user_db(connection, db_name):
-
-    # create table if not created
-    try:
-        # with connection.schema_editor() as schema_editor:
-        #     if not schema_editor.connection.introspection.table_names():
-        #         schema_editor.create_model(UserDocument)
-
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='django_migrations';")
-            table_exists = cursor.fetchone()
-
-        # print(f"the table:{table_exists}")
-
-        if not table_exists:
-            # call_command('makemigrations', 'backend', '--noinput')
-            call_command('migrate', 'backend', '--database', db_name, '--noinput')
-    
-    except OperationalError as e:
-        print(f"OperationalError: {e}")
-        # call_command('migrate', '--database', db_name, '--noinput')
-
-    migration_recorder = MigrationRecorder(connection)
-    applied_migrations = set(migration_recorder.applied_migrations())
-
-    loader = MigrationLoader(connection)
-    graph = loader.graph
-    leaf_nodes = set(graph.leaf_nodes())
-
-    unapplied_migrations = leaf_nodes - applied_migrations
-    unapplied_backend_migrations = {m for m in unapplied_migrations if m[0] == 'backend'}
-    # print(f"unapplied_migrations:{unapplied_backend_migrations}")
-
-    if unapplied_backend_migrations:
-        # call_command('makemigrations', 'backend', '--noinput')
-        call_command('migrate', 'backend', '--database', db_name, '--noinput')
-
 @csrf_exempt
 def upload_user_document(request):
     if request.method == 'POST':
@@ -505,14 +379,13 @@ def upload_user_document(request):
         display_date = request.POST.get('display_date')
         expire_date = request.POST.get('expire_date')
         file = request.FILES['file']
+        doc_md5 = doc_md5 or getattr(file, 'md5', None)  # hashed while the upload was received
 
         db_name = user_database_connection(user_id)
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
         with transaction.atomic(using=db_name):
-            apply_migrations_to_user_db(connection, db_name)
             # with connection.schema_editor() as schema_editor:
                 # if not schema_editor.connection.introspection.table_names():
                 #     schema_editor.create_model(UserDocument)
@@ -535,6 +408,7 @@ def upload_user_document(request):
                 'file': file,
             })
 
+            previous_md5 = None if created else document.doc_md5
             if not created:
                 document.user_id = user_id
                 document.doc_title = doc_title
@@ -550,133 +424,82 @@ def upload_user_document(request):
                 document.file.save(file.name, file)
                 document.save()
 
-            file.seek(0)
-            # Generate and save the thumbnail
-            if doc_type == 'pdf':
-                # Generate thumbnail for PDF
-                thumbnail = generate_pdf_thumbnail(file, doc_id)
-                document.thumbnail.save(thumbnail.name, thumbnail)
-                document.save()
-            elif doc_type == 'txt':
-                # Generate thumbnail for text file
-                try:
-                    text_preview = doc_text[:500] 
-                except:
-                    text_preview = doc_text[:]
-                thumbnail = generate_text_thumbnail(text_preview, doc_id)
-                document.thumbnail.save(thumbnail.name, thumbnail)
-                document.save()
-            elif file_type == 'videos':
-                thumbnail = generate_video_thumbnail(doc_uri, doc_id)
-                if thumbnail:
-                    document.thumbnail.save(thumbnail.name, thumbnail)
-                    document.save()
-
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = ON;')
-
-        return JsonResponse({'status': 'success', 'doc_id': document.doc_id}, status=200)
+        thumbnail_status = thumbnail_service.schedule(
+            document, doc_type, file_type, doc_text,
+            previous_md5=previous_md5, using=db_name, user_id=user_id,
+        )
+
+        return JsonResponse({
+            'status': 'success',
+            'doc_id': document.doc_id,
+            'thumbnail_status': thumbnail_status,
+            'thumbnail': thumbnail_service.thumbnail_url(document, BACKEND_URI),
+        }, status=200)
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
 @csrf_exempt
 def list_user_documents(request):
-    def fetch_documents(user_id, file_type=None, doc_id=None):
+    def fetch_documents(user_id, file_type=None, doc_id=None, fields=None, include_text=False, limit=None, cursor=None):
         '''
-        This function returns all the instance if no parameters are specified.
+        This function returns all the instance if no parameters are specified, one page at a time with limit or cursor.
         If file_type is specified, then it will filter the file_type.
         If doc_id is specified, then it will filter the doc_id.
+        Only `fields` are selected; doc_text and doc_meta need include_text in listings.
+        Returns (doc_list, next_cursor).
         '''
 
         db_name = user_database_connection(user_id)
         # print(db_name)
 
         connection = connections[db_name]
-        with connection.cursor() as cursor:
-            cursor.execute('PRAGMA foreign_keys = OFF;')
+        apply_migrations_to_user_db(connection, db_name)
 
-        try:
-            with transaction.atomic(using=db_name):
-                apply_migrations_to_user_db(connection, db_name)
+        # replace the name
+        fileType = file_type_label(file_type)
 
-                # replace the name
-                if file_type == 'documents': fileType = 'Document'
-                elif file_type == 'videos': fileType = 'Video'
-                else: fileType = 'Instance'
-
-                documents_query = UserDocument.objects.using(db_name).all()
-
-                if doc_id:
-                    document = documents_query.filter(doc_id=doc_id)
-                    if file_type and documents_query.exists() and documents_query.first().file_type != file_type:
-                        return []
-
-                    document = documents_query.first()
-
-                    doc_list = [{
-                        f"{fileType} ID": document.doc_id,
-                        f"{fileType} Title": document.doc_title, 
-                        f"{fileType} URI": document.doc_uri,
-                        f"{fileType} Type": document.doc_type,
-                        f"{fileType} Description": document.doc_desc,
-                        f"{fileType} Text": document.doc_text,
-                        "File Type": document.file_type,
-                        "Create Date": document.doc_createdate,
-                        "Revise Date": document.doc_revisedate,
-                        "Display Date": document.display_date,
-                        "Expire Date": document.expire_date,
-                        "Share Flag": document.share_flag,
-                        "Audit Flag": document.audit_flag,
-                        f"{fileType} Meta": document.doc_meta,
-                        f"{fileType} Location": document.doc_loc,
-                        f"{fileType} MD5": document.doc_md5
-                    }]
-                else:
-                    if file_type:
-                        documents_query = documents_query.filter(file_type=file_type)
-
-                    doc_list = []
-                    for doc in documents_query:
-                        doc_list.append({
-                            f"{fileType} ID": doc.doc_id,
-                            f"{fileType} Title": doc.doc_title,
-                            f"{fileType} URI": doc.doc_uri,
-                            f"{fileType} Type": doc.doc_type,
-                            f"{fileType} Description": doc.doc_desc,
-                            f"{fileType} Text": doc.doc_text,
-                            "File Type": doc.file_type,
-                            "Create Date": doc.doc_createdate,
-                            "Revise Date": doc.doc_revisedate,
-                            "Display Date": doc.display_date,
-                            "Expire Date": doc.expire_date,
-                            "Share Flag": doc.share_flag,
-                            "Audit Flag": doc.audit_flag,
-                            f"{fileType} Meta": doc.doc_meta,
-                            f"{fileType} Location": doc.doc_loc,
-                            f"{fileType} MD5": doc.doc_md5
-                        })
-
-            return doc_list
+        documents_query = UserDocument.objects.using(db_name).all()
 
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'error': e}, status=500)
+        if doc_id:
+            fields = resolve_fields(fields, include_text=True)
+            document = documents_query.filter(doc_id=doc_id).values(*fields, 'file_type').first()
+            if document is None or (file_type and document['file_type'] != file_type):
+                return [], None
+            return [to_response_row(document, fields, fileType)], None
+
+        if file_type:
+            documents_query = documents_query.filter(file_type=file_type)
+
+        return list_page(documents_query, fileType, resolve_fields(fields, include_text), limit, cursor)
             
     if request.method == 'POST':
         data = json.loads(request.body)
         user_id = data.get('user_id')
         doc_id = data.get('doc_id')
         file_type = data.get('file_type')
-        documents = fetch_documents(user_id, file_type, doc_id)
-        return JsonResponse({'status': 'success', 'documents': documents}, status=200)
+        try:
+            documents, next_cursor = fetch_documents(
+                user_id, file_type, doc_id,
+                fields=data.get('fields'),
+                include_text=data.get('include_text', False),
+                limit=data.get('limit'),
+                cursor=data.get('cursor'),
+            )
+        except InvalidListingParams as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        except Exception as e:
+            return JsonResponse({'status': 'error', 'error': str(e)}, status=500)
+        return JsonResponse({'status': 'success', 'documents': documents, 'next_cursor': next_cursor}, status=200)
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 ###############################
 
-import lancedb
 from lancedb.pydantic import Vector, LanceModel
 from .utils import datetime_to_timestamp, json_to_dataframe
+from .embeddings import embedding_service
+from .vector_index import index_manager
 
 class ResearchPaper(LanceModel):
         vector: Vector(1536) # type: ignore
@@ -703,24 +526,23 @@ class KnowledgeObject(LanceModel):
     display_date: int
     expire_date: int
 
-def fetch_embedding(row):
-    text = row['content']
-    embedding_response = requests.post(
-        f"{BACKEND_URI}/api/get_embedding/",
-        json={'text': text}
-    )
-    embedding = embedding_response.json().get('embedding')
-    return {
-        'vector': embedding,
-        'content': row['content'],
-        'doc_id': row['doc_id'],
-        'user_id': row['user_id'],
-        'file_type': row['file_type'],
-        'page_id': row['page'],
-        'chunk_id': row['id'],
-        'start': row['start'],
-        'end': row['end']
-    }
+def fetch_embeddings(df):
+    # one batched embedding pass for the whole document, rows keep their order
+    embeddings = embedding_service.embed(df['content'].tolist())
+    return [
+        {
+            'vector': embedding,
+            'content': row['content'],
+            'doc_id': row['doc_id'],
+            'user_id': row['user_id'],
+            'file_type': row['file_type'],
+            'page_id': row['page'],
+            'chunk_id': row['id'],
+            'start': row['start'],
+            'end': row['end']
+        }
+        for row, embedding in zip(df.to_dict('records'), embeddings)
+    ]
 
 @csrf_exempt
 def store_research_in_db(request):
@@ -734,24 +556,20 @@ def store_research_in_db(request):
         display_date = datetime_to_timestamp(datetime.fromisoformat(data.get('display_date')))
         expire_date = datetime_to_timestamp(datetime.fromisoformat(data.get('expire_date')))
 
-        # Connect to LanceDB
-        if user_doc == False:
-            vdb = lancedb.connect(LANCEDB_URI)
-        else:
-            vdb = lancedb.connect(f'userdbs/{user_id}/lancedb')
+        # Cached LanceDB handle
+        vdb_uri = LANCEDB_URI if user_doc == False else user_lancedb_uri(user_id)
 
         # Convert JSON data to DataFrame
         df = json_to_dataframe(json_data, doc_id=doc_id, user_id=user_id, file_type=file_type)
-        tbl_research = vdb.create_table("Research_paper_table", schema=ResearchPaper.to_arrow_schema(), exist_ok=True)
+        tbl_research = lance_cache.table(vdb_uri, "Research_paper_table", ResearchPaper.to_arrow_schema())
 
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            futures = [executor.submit(fetch_embedding, row) for _, row in df.iterrows()]
-            records = [future.result() for future in as_completed(futures)]
+        records = fetch_embeddings(df)
 
         records_df = pd.DataFrame(records)
         records_df['display_date'] = display_date
         records_df['expire_date'] = expire_date
         tbl_research.add(records_df)
+        index_manager.schedule(vdb_uri, "Research_paper_table")
 
         return JsonResponse({'status': 'success'}, status=200)
     return JsonResponse({'error': 'Invalid request method'}, status=400)
@@ -768,24 +586,20 @@ def store_knowledge_in_db(request):
         display_date = datetime_to_timestamp(datetime.fromisoformat(data.get('display_date')))
         expire_date = datetime_to_timestamp(datetime.fromisoformat(data.get('expire_date')))
 
-        # Connect to LanceDB
-        if user_doc == False:
-            vdb = lancedb.connect(LANCEDB_URI)
-        else:
-            vdb = lancedb.connect(f'userdbs/{user_id}/lancedb')
+        # Cached LanceDB handle
+        vdb_uri = LANCEDB_URI if user_doc == False else user_lancedb_uri(user_id)
 
         # Convert JSON data to DataFrame
         df = json_to_dataframe(json_data, doc_id=doc_id, user_id=user_id, file_type=file_type)
-        tbl_research = vdb.create_table("KnowledgeObject_table", schema=KnowledgeObject.to_arrow_schema(), exist_ok=True)
+        tbl_research = lance_cache.table(vdb_uri, "KnowledgeObject_table", KnowledgeObject.to_arrow_schema())
 
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            futures = [executor.submit(fetch_embedding, row) for _, row in df.iterrows()]
-            records = [future.result() for future in as_completed(futures)]
+        records = fetch_embeddings(df)
 
         records_df = pd.DataFrame(records)
         records_df['display_date'] = display_date
         records_df['expire_date'] = expire_date
         tbl_research.add(records_df)
+        index_manager.schedule(vdb_uri, "KnowledgeObject_table")
 
         return JsonResponse({'status': 'success'}, status=200)
     return JsonResponse({'error': 'Invalid request method'}, status=400)
@@ -796,8 +610,7 @@ def display_research_paper_table(request):
     doc_id = data.get('doc_id')
 
     try:
-        db = lancedb.connect("master/lancedb/")
-        tbl = db.open_table("Research_paper_table")
+        tbl = get_master_table("Research_paper_table")
 
         if doc_id:
             print(doc_id)
@@ -832,45 +645,7 @@ def process_meta_item(request):
         doc_meta_tmp = data.get('doc_meta_tmp')
         languagestr = data.get('languagestr', 'en')
 
-        base64Frames = []
-        # base_video_path, _ = os.path.splitext(video_path)
-
-        video = cv2.VideoCapture(video_path)
-        fps = video.get(cv2.CAP_PROP_FPS)
-
-        # Extract frames within the start and end times
-        start_time = meta_item.get('start')
-        end_time = meta_item.get('end')
-        if start_time is not None and end_time is not None:
-            for time_point in range(int(start_time), int(end_time), 2):
-                frame_number = int(time_point * fps)
-                video.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-                success, frame = video.read()
-                if success:
-                    _, buffer = cv2.imencode(".jpg", frame)
-                    base64Frames.append(base64.b64encode(buffer).decode("utf-8"))
-
-        video.release()
-
-        # Extract audio from video
-        audio_path = f"{os.path.dirname(video_path)}/audios/{os.path.basename(video_path)}"
-        clip = VideoFileClip(video_path)
-        clip.audio.write_audiofile(audio_path, bitrate="32k")
-        clip.audio.close()
-        clip.close()
-
-        # Generate summary
-        transcript_data = "\n".join([item['text'] for item in doc_meta_tmp])
-        extra_info = f"The abstract of this video is {meta_item['text']}."
-        summary = generate_summary(base64Frames, transcript_data, extra_info, languagestr)
-
-        meta_item['text'] = summary  # Update the summary in meta_item
-
-        response_data = {
-            'meta_item': meta_item,
-            'base64Frames': base64Frames,
-            'audio_path': audio_path
-        }
+        response_data = summarize_meta_item(video_path, meta_item, doc_meta_tmp, languagestr)
 
         return JsonResponse(response_data, status=200)
 
@@ -880,113 +655,88 @@ def process_meta_item(request):
 def extract_text_from_video(request):
     if request.method == 'POST':
         try:
-            video_content = request.FILES['file'].read()
-            temp_dir = os.path.join(os.getcwd(), 'temp')
-            os.makedirs(temp_dir, exist_ok=True)
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', dir=temp_dir) as temp_video_file:
-                temp_video_file.write(video_content)
-                temp_video_file_path = temp_video_file.name
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3', dir=temp_dir) as temp_output_file:
-                temp_output_file_name = temp_output_file.name
+            uploaded_file = request.FILES['file']
+            temp_dir = UPLOAD_TEMP_DIR
+            # the upload is already on disk (MD5TemporaryFileUploadHandler), ffmpeg gets a path to it
+            temp_video_file_path = persist_upload(uploaded_file, temp_dir, suffix='.mp4')
 
-            if extract_audio(temp_video_file_path, temp_output_file_name):
-                print(f"temp_output_file_name: {temp_output_file_name}")
-                transcripts = extract_and_concatenate_segments(transcribe_audio(temp_output_file_name, temp_dir))
-
-            os.remove(temp_video_file_path)
-            os.remove(temp_output_file_name)
+            try:
+                transcripts = transcribe_video(temp_video_file_path, temp_dir)
+            finally:
+                os.remove(temp_video_file_path)
 
             print("transcripts:",transcripts)
             
-            return JsonResponse({'status': 'success', 'transcripts': transcripts}, status=200)
+            return JsonResponse({'status': 'success', 'transcripts': transcripts, 'doc_md5': getattr(uploaded_file, 'md5', None)}, status=200)
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
-def extract_audio(input_file,output_file):
-    file_extension = os.path.splitext(input_file)[1].lower()
+########################
+# background jobs
+
+# kinds a JSON body may submit and the params they take; extract_text_from_video deletes
+# its video_path when done, so it only runs on a file persisted from a multipart upload
+JSON_JOB_PARAMS = {
+    'process_meta_item': {'video_path', 'meta_item', 'doc_meta_tmp', 'languagestr'},
+}
 
-    if file_extension in (".mp4", ".avi", ".mkv"):
+@csrf_exempt
+def submit_job(request):
+    '''
+    multipart/form-data with kind=extract_text_from_video and a file, or
+    JSON {"kind": "process_meta_item", "params": {...}}.
+    Returns the job id right away, the work runs on the job workers.
+    '''
+    if request.method == 'POST':
         try:
-            ffmpeg_extract_audio(input_file, output_file)
-            print(f"Audio extracted from video and saved as {output_file}")
-            return True
+            if request.content_type == 'multipart/form-data':
+                kind = request.POST.get('kind', 'extract_text_from_video')
+                if kind != 'extract_text_from_video':
+                    return JsonResponse({'status': 'error', 'message': f'{kind} does not take an upload'}, status=400)
+
+                temp_dir = UPLOAD_TEMP_DIR
+                uploaded_file = request.FILES['file']
+                video_path = persist_upload(uploaded_file, temp_dir, suffix='.mp4')
+                params = {'video_path': video_path, 'temp_dir': temp_dir, 'doc_md5': getattr(uploaded_file, 'md5', None)}
+            else:
+                data = json.loads(request.body)
+                kind = data.get('kind')
+                params = data.get('params', {})
+                if kind not in JSON_JOB_PARAMS:
+                    return JsonResponse({'status': 'error', 'message': f'{kind} cannot be submitted as JSON'}, status=400)
+                if not isinstance(params, dict) or not set(params) <= JSON_JOB_PARAMS[kind]:
+                    return JsonResponse({'status': 'error', 'message': f'params of {kind} must be an object with keys from {sorted(JSON_JOB_PARAMS[kind])}'}, status=400)
+
+            job_id = job_queue.submit(kind, **params)
+            return JsonResponse({'status': 'queued', 'job_id': job_id}, status=202)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
         except Exception as e:
-            print(f"(ffmpeg_extract_audio) Error: {e}")
-            return False
-    elif file_extension in (".mp3", ".m4a",".wav"):
-        print("Input file is already an audio file.")
-        return False
-    else:
-        print("Unsupported file format.")
-        return False
-    
-def transcribe_audio(file_path, temp_dir):
-    CHUNK_SIZE_MB = 1
-    CHUNK_SIZE_BYTES = int(CHUNK_SIZE_MB * 1024 * 1024 * 0.5)
-
-    try:
-        audio = AudioSegment.from_file(file_path)
-        # print(f"len audio:{len(audio)}")
-        # print(f"CHUNK_SIZE_BYTES:{(CHUNK_SIZE_BYTES)}")
-    except Exception as e:
-        print(f"(transcribe_audio) An AudioSegmenterror occurred: {e}")
-        print(f"file_path: {file_path}")
-        return None
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
-    chunks = [audio[i:i + CHUNK_SIZE_BYTES] for i in range(0, len(audio), CHUNK_SIZE_BYTES)]
-    
-    try:
-        transcripts = []
-        for i, chunk in enumerate(chunks):
-            # print(i)
-            fd, temp_audio_file = tempfile.mkstemp(suffix=".mp3", dir=temp_dir)
-            os.close(fd)  # Close the file descriptor
-            chunk.export(temp_audio_file, format="mp3")
-            # print(i)
-            with open(temp_audio_file, "rb") as audio_file:
-                transcript = openai.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    response_format="verbose_json",
-                    timestamp_granularities=["segment"]
-                )
-                transcripts.append(transcript)
-
-            os.remove(temp_audio_file)
+def job_status(request, job_id):
+    if request.method == 'GET':
+        job = job_queue.get(job_id)
+        if job is None:
+            return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+        return JsonResponse({
+            'job_id': job['job_id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'progress': job['progress'],
+            'message': job['message'],
+            'result': job['result'],
+            'error': job['error'],
+        }, status=200)
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
-    except Exception as e:
-        print(f"(transcribe_audio) An error occurred: {e}")
-        return None
-    
-    # print(f"transcripts: {transcripts}")
-    
-    return transcripts
-
-def extract_and_concatenate_segments(transcripts):
-    concatenated_segments = []
-    max_id = 0
-    last_end_time = 0.0
-
-    for translation in transcripts:
-        for segment in translation.segments:
-            new_segment = {
-                "id": max_id,
-                "start": segment['start'],
-                "end": segment['end'],
-                "content": segment['text']
-            }
-            new_segment['start'] += last_end_time
-            new_segment['end'] += last_end_time
-            concatenated_segments.append(new_segment)
-            max_id += 1
-#            st.info(f"""new_segment(before):{new_segment}""")
-
-        if translation.segments:
-            last_end_time += translation.segments[-1]['end']
-  
-    return json.dumps(concatenated_segments, ensure_ascii=False, indent=4)
-
-################################
\ No newline at end of file
+@csrf_exempt
+def cancel_job(request, job_id):
+    if request.method == 'POST':
+        job = job_queue.cancel(job_id)
+        if job is None:
+            return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+        return JsonResponse({'job_id': job_id, 'status': job['status'], 'cancel_requested': job['cancel_requested']}, status=200)
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)